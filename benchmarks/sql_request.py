@@ -0,0 +1,58 @@
+"""
+Times sql_request turning rows into namedtuples, the way it did before
+row_type (a new namedtuple class per call) against the way it does now (one
+class per column signature, reused). Needs no database:
+
+    python -m benchmarks.sql_request
+"""
+
+from collections import namedtuple
+import timeit
+
+from src.base import sql_request
+
+COLUMNS = ("optionid", "emoji", "option", "votecount", "votes")
+ROWS = [(i, "0001F44D", f"option {i}", i, [1, 2, 3]) for i in range(10)]
+CALLS = 20000
+
+
+class Column(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class Cursor(object):
+    description = [Column(name) for name in COLUMNS]
+
+    def execute(self, call, args=None):
+        pass
+
+    def fetchall(self):
+        return ROWS
+
+
+def old_sql_request(cursor, call, args):
+    cursor.execute(call, args)
+
+    desc = [field.name for field in cursor.description]
+    Named = namedtuple('sql_return', desc)
+    reply = cursor.fetchall()
+
+    if len(desc) == 1:
+        return [i[0] for i in reply]
+
+    return [Named(*i) for i in reply]
+
+
+def main():
+    cursor = Cursor()
+    for name, func in (("namedtuple per call", old_sql_request),
+                       ("cached row_type", sql_request)):
+        seconds = min(timeit.repeat(lambda: func(cursor, "readout", (1,)),
+                                    number=CALLS, repeat=3))
+        print(f"{name:>20}: {seconds / CALLS * 1e6:7.2f} us per call "
+              f"({len(ROWS)} rows of {len(COLUMNS)} columns)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Times tex2png rendering the same snippet with the preamble read from scratch
+every time (formatdir=None) against the precompiled format from get_format.
+Needs latex and dvipng in /usr/bin:
+
+    python -m benchmarks.tex2png [renders]
+"""
+
+import asyncio
+import sys
+import tempfile
+import time
+
+from src.tex2png import get_format, tex2png
+
+SNIPPET = r"\int_0^\infty e^{-x^2} \, dx = \frac{\sqrt{\pi}}{2}"
+RENDERS = 20
+
+
+async def time_renders(renders: int, formatdir):
+    """
+    :return: the seconds taken by renders renders one after another.
+    """
+    start = time.monotonic()
+    for _ in range(renders):
+        status, png = await tex2png(SNIPPET, formatdir=formatdir)
+        if status != 0:
+            raise RuntimeError(f"render failed with status {status}")
+    return time.monotonic() - start
+
+
+async def main(renders: int):
+    with tempfile.TemporaryDirectory() as formatdir:
+        # build the format outside the timing, as Renderer.prepare does
+        start = time.monotonic()
+        fmt = await get_format("/usr/bin/latex", formatdir, 20, 30)
+        if fmt is None:
+            print("the format could not be built; is latex installed in "
+                  "/usr/bin?")
+            return
+        print(f"{'format build':>16}: {time.monotonic() - start:7.3f} s")
+
+        for name, directory in (("no format", None),
+                                ("format", formatdir)):
+            seconds = await time_renders(renders, directory)
+            print(f"{name:>16}: {seconds / renders * 1e3:7.1f} ms per render "
+                  f"({renders} renders)")
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else RENDERS))
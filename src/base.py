@@ -1,5 +1,6 @@
 """
 A set of functions that get called often from multiple modules.
+Connection - a pool of database connections, used off the event loop.
 sql_request - wraps psycopg2's cursor.execute to make it usable with
               namedtuples.
 delete_source - a decorator to delete the message that calls a command.
@@ -9,11 +10,13 @@ random_color - generates a random bright color for embeds.
 
 from discord.ext import commands
 import discord
-from functools import wraps
+from functools import wraps, lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
-from collections import namedtuple
+from collections import namedtuple, deque
+import asyncio
 import random
-
+import time
 
 
 USER_DELETE_DELAY = 3
@@ -25,6 +28,15 @@ RANDOM_COLOR_V = 0.9
 
 CRITICAL_DATABASE_ISSUE = "Critical Error for SQL call:\n{}"
 
+DATABASE_MIN_CONNECTIONS = 1
+DATABASE_MAX_CONNECTIONS = 4
+# seconds a pooled connection may sit unused before it is checked with a
+# SELECT 1, and before spare connections above the minimum are closed.
+DATABASE_IDLE_CHECK = 30
+DATABASE_IDLE_TIMEOUT = 300
+DATABASE_RETRIES = 3
+DATABASE_BACKOFF = 0.5
+
 
 class ArgIsNaN(Exception):
     pass
@@ -39,22 +51,291 @@ class UserNotFound(Exception):
     pass
 
 
+class Statements(object):
+    """
+    A registry of the named queries in the cogs' sql_requests. Every
+    single-statement query is prepared server-side the first time it runs on
+    a connection, and after that only its name and arguments are sent.
+    """
+
+    PREPARABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+    def __init__(self):
+        # sql -> (statement name, number of arguments)
+        self.names = {}
+
+    def register(self, prefix: str, requests):
+        """
+        Adds a cog's requests to the registry. Queries that can't be prepared
+        (scripts with several statements, DDL) are skipped and run as text.
+        :param prefix: prefixed to each statement name to keep them unique.
+        :param requests: a mapping of request names to sql.
+        """
+        for name, call in requests.items():
+            body = call.strip().rstrip(";")
+            if ";" in body or \
+                    not body.upper().startswith(self.PREPARABLE):
+                continue
+            self.names[call] = (f"{prefix}_{name}", body.count("%s"))
+
+    @staticmethod
+    def to_prepared(call: str):
+        """
+        Turns psycopg2's %s placeholders into postgres' $n ones.
+        """
+        parts = call.strip().rstrip(";").split("%s")
+        text = parts[0]
+        for i, part in enumerate(parts[1:], start=1):
+            text += f"${i}" + part
+        return text.replace("%%", "%")
+
+    def prepare(self, cursor, prepared: set, call: str):
+        """
+        Makes sure call is prepared on cursor's connection.
+        :param cursor: the cursor to prepare with.
+        :param prepared: the names already prepared on this connection.
+        :param call: the sql to run.
+        :return: the sql to execute instead of call.
+        """
+        if call not in self.names:
+            return call
+
+        name, num_args = self.names[call]
+        if name not in prepared:
+            try:
+                cursor.execute(f"PREPARE {name} AS {self.to_prepared(call)}")
+            except psycopg2.ProgrammingError:
+                # postgres couldn't work out the argument types on its own,
+                # so keep sending this one as text.
+                self.names.pop(call, None)
+                return call
+            prepared.add(name)
+
+        if num_args == 0:
+            return f"EXECUTE {name}"
+        return f"EXECUTE {name} ({', '.join(['%s'] * num_args)})"
+
+
+class Lease(object):
+    """
+    A single pooled connection checked out for the length of one command.
+    Every call made through the same lease uses the same session, and a lease
+    that finds its socket dead reconnects (with backoff) and retries, as long
+    as nothing had been sent yet.
+    Use as `async with conn.lease() as db:`.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+        self.idle_since = None
+        # names of the statements prepared on conn
+        self.prepared = set()
+
+    async def __aenter__(self):
+        await self.pool.checkout(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.pool.checkin(self)
+
+    def _connect(self):
+        self.conn = None
+        self.conn = self.pool.conn_func()
+        self.idle_since = None
+        self.prepared = set()
+
+    def _call(self, func, args):
+        for attempt in range(DATABASE_RETRIES):
+            sent = False
+            try:
+                if self.conn is None or self.conn.closed:
+                    self._connect()
+
+                cursor = self.conn.cursor()
+                try:
+                    # a connection that has been idle for a while may have
+                    # been dropped by the server without us noticing.
+                    if self.idle_since is not None and \
+                            time.monotonic() - self.idle_since > \
+                            DATABASE_IDLE_CHECK:
+                        cursor.execute("SELECT 1")
+                    self.idle_since = None
+                    sent = True
+                    return func(cursor, *args)
+                finally:
+                    cursor.close()
+
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                # errors on a live connection come from the query itself
+                if self.conn is not None and not self.conn.closed:
+                    raise
+                self.conn = None
+                # the connection is autocommit, so a statement that was sent
+                # may have committed before the socket died. running it again
+                # could create a second poll or parrot.
+                if sent or attempt + 1 == DATABASE_RETRIES:
+                    raise
+                time.sleep(DATABASE_BACKOFF * 2 ** attempt)
+
+    def _request(self, cursor, call, args):
+        call = self.pool.statements.prepare(cursor, self.prepared, call)
+        return sql_request(cursor, call, args)
+
+    def _execute(self, cursor, call, args):
+        call = self.pool.statements.prepare(cursor, self.prepared, call)
+        cursor.execute(call, args)
+
+    async def run(self, func, *args):
+        """
+        Runs func(cursor, *args) on the database executor.
+        :param func: a blocking function taking a cursor as its first argument.
+        :param args: any further arguments to pass to func.
+        :return: whatever func returns.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.pool.executor, self._call,
+                                          func, args)
+
+    async def request(self, call, args=None):
+        """
+        The awaitable version of sql_request.
+        :param call: the sql to call.
+        :param args: the list of arguments to be passed to the sql request.
+        :return: see sql_request.
+        """
+        return await self.run(self._request, call, args)
+
+    async def execute(self, call, args=None):
+        """
+        Executes sql that returns no rows.
+        :param call: the sql to call.
+        :param args: the list of arguments to be passed to the sql request.
+        """
+        await self.run(self._execute, call, args)
+
+
 class Connection(object):
-    def __init__(self, conn_func):
+    """
+    A pool of psycopg2 connections that cogs never touch from the event loop
+    thread. psycopg2 is blocking, so every call is handed to a thread pool
+    with one worker per connection and awaited; a slow round trip then only
+    delays the command that made it instead of every event in every guild.
+
+    request/execute/run lease a connection for a single call. Commands that
+    want several calls on one session can hold a lease themselves.
+    """
+    def __init__(self, conn_func,
+                 min_size: int = DATABASE_MIN_CONNECTIONS,
+                 max_size: int = DATABASE_MAX_CONNECTIONS):
         self.conn_func = conn_func
-        self.conn = conn_func()
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statements = Statements()
+
+        # idle connections, most recently used last, as
+        # (connection, last use, prepared statement names)
+        self.idle = deque((conn_func(), time.monotonic(), set())
+                          for _ in range(min_size))
+        self.in_use = 0
+        self.slots = asyncio.Semaphore(max_size)
+        self.executor = ThreadPoolExecutor(max_workers=max_size)
+
+        # metrics
+        self.leases = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def lease(self):
+        return Lease(self)
+
+    async def checkout(self, lease: Lease):
+        contended = self.slots.locked()
+        start = time.monotonic()
+        await self.slots.acquire()
+        waited = time.monotonic() - start
+
+        self.leases += 1
+        self.wait_time += waited
+        self.max_wait = max(self.max_wait, waited)
+        if contended:
+            self.waits += 1
+
+        self.in_use += 1
+        if self.idle:
+            lease.conn, lease.idle_since, lease.prepared = self.idle.pop()
+
+    def checkin(self, lease: Lease):
+        self.in_use -= 1
+        if lease.conn is not None and not lease.conn.closed:
+            self.idle.append((lease.conn, time.monotonic(), lease.prepared))
+        lease.conn = None
+
+        # let the pool shrink back down after a burst
+        now = time.monotonic()
+        while len(self.idle) > self.min_size and \
+                now - self.idle[0][1] > DATABASE_IDLE_TIMEOUT:
+            conn, _, _ = self.idle.popleft()
+            conn.close()
+
+        self.slots.release()
+
+    @property
+    def size(self):
+        return len(self.idle) + self.in_use
+
+    def stats(self):
+        """
+        :return: a dict of pool metrics, suitable for logging.
+        """
+        return {
+            "size": self.size,
+            "idle": len(self.idle),
+            "in_use": self.in_use,
+            "leases": self.leases,
+            "waits": self.waits,
+            "mean_wait": self.wait_time / self.leases if self.leases else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+    async def run(self, func, *args):
+        """
+        Runs func(cursor, *args) on a leased connection.
+        :param func: a blocking function taking a cursor as its first argument.
+        :param args: any further arguments to pass to func.
+        :return: whatever func returns.
+        """
+        async with self.lease() as lease:
+            return await lease.run(func, *args)
+
+    async def request(self, call, args=None):
+        """
+        Runs Lease.request on a leased connection.
+        """
+        async with self.lease() as lease:
+            return await lease.request(call, args)
+
+    async def execute(self, call, args=None):
+        """
+        Runs Lease.execute on a leased connection.
+        """
+        async with self.lease() as lease:
+            await lease.execute(call, args)
 
-    def cursor(self):
-        try:
-            return self.conn.cursor()
-        except Exception:
-            self.conn = self.conn_func()
-            return self.conn.cursor()
 
 class CommandError(Exception):
     def __init__(self, command):
      self.command = command
 
+@lru_cache(maxsize=None)
+def row_type(columns: tuple):
+    """
+    Gets the namedtuple class for a set of column names, so that each result
+    shape only has its class built once.
+    """
+    return namedtuple('sql_return', columns)
+
+
 # simple wrapper function to turn psycopg2's returns into named tuples.
 # returns a list if single element was requested, otherwise a namedtuple
 def sql_request(cursor, call, args):
@@ -73,18 +354,17 @@ def sql_request(cursor, call, args):
     """
     cursor.execute(call, args)
 
-    desc = [field.name for field in cursor.description]
-    Named = namedtuple('sql_return', desc)
     try:
         reply = cursor.fetchall()
     except psycopg2.ProgrammingError:
         print(CRITICAL_DATABASE_ISSUE.format(call))
         return []
 
-    if len(desc) == 1:
+    if len(cursor.description) == 1:
         return [i[0] for i in reply]
 
-    return [Named(*i) for i in reply]
+    Named = row_type(tuple(field.name for field in cursor.description))
+    return [Named._make(i) for i in reply]
 
 
 def delete_source(f):
@@ -0,0 +1,160 @@
+"""
+Small in-memory caches shared between cogs.
+LRUCache - a dict-like cache with least-recently-used and idle-time eviction.
+FileCache - a size-capped cache of bytes on disk, which outlives the process.
+"""
+
+from collections import OrderedDict
+import os
+import time
+
+
+class LRUCache(object):
+    """
+    A dict-like cache. When more than max_size entries are stored, the least
+    recently used one is evicted, and entries that have not been touched for
+    max_idle seconds (if given) are dropped the next time the cache is used.
+    Hit and miss counts are kept for get().
+    """
+
+    def __init__(self, max_size: int, max_idle: float = None):
+        self.max_size = max_size
+        self.max_idle = max_idle
+
+        # key -> (value, last access), least recently used first
+        self.data = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def expire(self):
+        """
+        Drops every entry that has been idle for longer than max_idle.
+        """
+        if self.max_idle is None:
+            return
+
+        cutoff = time.monotonic() - self.max_idle
+        while self.data:
+            key, (_, last_used) = next(iter(self.data.items()))
+            if last_used >= cutoff:
+                break
+            del self.data[key]
+
+    def get(self, key, default=None):
+        self.expire()
+        try:
+            value, _ = self.data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self.data[key] = (value, time.monotonic())
+        return value
+
+    def put(self, key, value):
+        self.expire()
+        self.data.pop(key, None)
+        self.data[key] = (value, time.monotonic())
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        value = self.data.pop(key, None)
+        if value is None:
+            return default
+        return value[0]
+
+    def clear(self):
+        self.data.clear()
+
+    def values(self):
+        return [value for value, _ in self.data.values()]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+
+class FileCache(object):
+    """
+    Bytes kept as files in a directory, one per key, so they survive a
+    restart. When the files add up to more than max_bytes, the least
+    recently used ones are deleted. Keys have to be usable as file names.
+    Hit and miss counts are kept for get().
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        # key -> file size, least recently used first
+        self.sizes = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(path, exist_ok=True)
+        files = []
+        for entry in os.scandir(path):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, key, size in sorted(files):
+            self.sizes[key] = size
+            self.size += size
+        self.evict()
+
+    def file(self, key):
+        return os.path.join(self.path, key)
+
+    def evict(self):
+        while self.size > self.max_bytes and self.sizes:
+            key, size = self.sizes.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self.file(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key, default=None):
+        if key not in self.sizes:
+            self.misses += 1
+            return default
+
+        try:
+            with open(self.file(key), 'rb') as fd:
+                value = fd.read()
+            # the modification time orders the files on the next startup
+            os.utime(self.file(key))
+        except OSError:
+            self.size -= self.sizes.pop(key)
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self.sizes.move_to_end(key)
+        return value
+
+    def put(self, key, value: bytes):
+        # written under another name first, so a crash never leaves a
+        # truncated file behind
+        temp = self.file(key) + ".tmp"
+        with open(temp, 'wb') as fd:
+            fd.write(value)
+        os.replace(temp, self.file(key))
+
+        self.size -= self.sizes.pop(key, 0)
+        self.sizes[key] = len(value)
+        self.size += len(value)
+        self.evict()
+
+    def __contains__(self, key):
+        return key in self.sizes
+
+    def __len__(self):
+        return len(self.sizes)
@@ -1,10 +1,28 @@
-from src.tex2png import tex2png
+from src.tex2png import Renderer, RenderBusy
+from src.cache import LRUCache, FileCache
 
 import discord
 from discord.ext import commands
 from src.base import *
 import box
-import time, os
+import os, io, hashlib, tempfile
+
+# renders allowed to run at once, and to wait for them
+MAX_RENDERS = 2
+MAX_QUEUED_RENDERS = 8
+
+# everything that changes what a snippet looks like; part of the cache key
+RENDER_OPTIONS = dict(density=500,
+                      background="Transparent",
+                      foreground="rgb 1.0 1.0 1.0",
+                      fontsize=20,
+                      mathsize=30)
+
+# renders kept in memory, and bytes of renders kept on disk
+RENDER_CACHE_SIZE = 128
+RENDER_CACHE_BYTES = 64 * 1024 * 1024
+RENDER_CACHE_DIR = os.environ.get(
+    'RENDER_CACHE_DIR', os.path.join(tempfile.gettempdir(), "math-renders"))
 
 class MathError(CommandError):
     def __init__(self, message):
@@ -19,29 +37,81 @@ class MathCog(commands.Cog):
         with open(math_file, 'r') as msg_file:
             self.messages = box.Box.from_yaml(msg_file)
 
-    @commands.command()
-    @delete_source
-    async def math(self, ctx: commands.context, *, snippet: str):
+        self.renderer = Renderer(MAX_RENDERS, MAX_QUEUED_RENDERS,
+                                 debug=False,
+                                 latex='latex',
+                                 dvipng='/app/.apt/usr/bin/dvipng',
+                                 checks=False,
+                                 **RENDER_OPTIONS)
 
-        photo_id = f"snippet{int(time.time() * 1000)}"
+        # render key -> png bytes
+        self.renders = LRUCache(RENDER_CACHE_SIZE)
+        self.stored_renders = FileCache(RENDER_CACHE_DIR, RENDER_CACHE_BYTES)
 
-        res = tex2png(snippet,
-                      debug=False,
-                      density=500,
-                      background="Transparent",
-                      foreground="rgb 1.0 1.0 1.0",
-                      outfile=photo_id,
-                      latex='latex',
-                      dvipng='/app/.apt/usr/bin/dvipng',
-                      checks=False
-                      )
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await self.renderer.prepare()
+
+    @staticmethod
+    def render_key(snippet: str):
+        options = repr(sorted(RENDER_OPTIONS.items()))
+        return hashlib.sha256(
+            (options + "\0" + snippet).encode('utf-8')).hexdigest()
+
+    async def render(self, snippet: str):
+        """
+        Renders a snippet to png.
+        :return: the png, as bytes.
+        """
+        try:
+            res, image = await self.renderer.render(snippet)
+        except RenderBusy:
+            raise MathError("busy")
 
         if res > 0:
             raise MathError("dependencies_missing")
         if res < 0:
             raise MathError("invalid")
 
-        await ctx.send(content=self.messages.header.format(ctx.author.mention),
-                       file=discord.File(photo_id + ".png"))
+        return image
+
+    async def get_png(self, snippet: str):
+        """
+        Gets the png of a snippet from memory, then from disk, and renders
+        it only if neither has it.
+        """
+        key = self.render_key(snippet)
+
+        image = self.renders.get(key)
+        if image is not None:
+            return image
+
+        image = self.stored_renders.get(key)
+        if image is None:
+            image = await self.render(snippet)
+            self.stored_renders.put(key, image)
+
+        self.renders.put(key, image)
+        return image
+
+    def stats(self):
+        """
+        :return: the hits and misses of the memory and disk render caches,
+        and the bytes stored on disk.
+        """
+        return {
+            "memory_hits": self.renders.hits,
+            "memory_misses": self.renders.misses,
+            "disk_hits": self.stored_renders.hits,
+            "disk_misses": self.stored_renders.misses,
+            "disk_bytes": self.stored_renders.size,
+        }
 
-        os.remove(photo_id + ".png")
+    @commands.command()
+    @delete_source
+    async def math(self, ctx: commands.context, *, snippet: str):
+
+        image = await self.get_png(snippet)
+
+        await ctx.send(content=self.messages.header.format(ctx.author.mention),
+                       file=discord.File(io.BytesIO(image), "math.png"))
@@ -1,13 +1,30 @@
-import discord, os, asyncio
+import discord, os, asyncio, random
+import psycopg2
 from discord.ext import commands
 from src.base import *
+from src.triggers import TriggerAutomaton, TriggerIndex
+from src.cache import LRUCache
+from src.ratelimit import TokenBucket
 import box
 from typing import Optional
+from collections import Counter, defaultdict
 
 MIN_TRIGGER_LEN = 3
 MAX_TRIGGER_LEN = 255
 MAX_RESPONSE_LEN = 255
 
+# number of parrots whose responses are kept in memory
+RESPONSE_CACHE_SIZE = 256
+
+# parrot replies allowed per second, and in a burst, in each channel
+CHANNEL_REPLY_RATE = 1 / 5
+CHANNEL_REPLY_BURST = 3
+# how often any one parrot may reply, across all channels
+PARROT_REPLY_RATE = 1 / 30
+PARROT_REPLY_BURST = 2
+
+MAX_MESSAGE_LEN = 2000
+
 
 class ParrotError(CommandError):
     def __init__(self, message):
@@ -22,66 +39,277 @@ class ParrotCog(commands.Cog):
         self.conn = conn
         with open(parrot_file, 'r') as msg_file:
             self.messages = box.Box.from_yaml(msg_file)
-        self.toggle = True
-
-    def get_parrot(self, trigger):
+        conn.statements.register(self.messages.component,
+                                 self.messages.sql_requests)
+
+        # every trigger and alias by guild, filled in on_ready and kept
+        # current by create/alias/delete, so on_message only queries on a
+        # match and commands resolve parrot names without queries at all
+        self.triggers = defaultdict(TriggerAutomaton)
+        self.trigger_index = defaultdict(TriggerIndex)
+        self.triggers_loaded = False
+
+        # parrot id -> tuple of its responses
+        self.responses = LRUCache(RESPONSE_CACHE_SIZE)
+
+        # filter stage -> number of messages it stopped
+        self.filter_counts = Counter()
+
+        # ids of the guilds and channels parrots are turned off in, filled
+        # in on_ready and kept current by toggle
+        self.disabled_guilds = set()
+        self.disabled_channels = set()
+
+        # channel id -> TokenBucket, and parrot id -> TokenBucket
+        self.channel_buckets = {}
+        self.parrot_buckets = {}
+
+    async def load_triggers(self):
+        """
+        Fills the trigger automaton and index from the database, once.
+        """
+        if self.triggers_loaded:
+            return
 
-        trigger = trigger.lower()
+        triggers = await self.conn.request(
+            self.messages.sql_requests.all_triggers)
+        if self.triggers_loaded:
+            return
 
-        cursor = self.conn.cursor()
+        for trigger in triggers:
+            # parrots from before guilds were recorded match nowhere
+            if trigger.guildid is None:
+                continue
+            self.add_trigger(trigger.guildid, trigger.trigger,
+                             trigger.parrotid, trigger.alias)
+        self.triggers_loaded = True
+
+    async def assign_guilds(self):
+        """
+        Parrots made before guilds were stored can only be placed if the bot
+        is in a single guild; they are given to that guild. Otherwise, the
+        ones left over are logged, to be claimed with !parrot claim.
+        """
         requests = self.messages.sql_requests
 
-        # search for exact match
-        parrot_ids = sql_request(cursor,
-                                 requests.get_id,
-                                 (trigger,))
-
-        if len(parrot_ids) > 1:
+        if len(self.bot.guilds) == 1:
+            await self.claim_parrots(self.bot.guilds[0].id)
+
+        unassigned = (await self.conn.request(
+            requests.unassigned_parrots))[0]
+        if unassigned:
+            print(f"parrot: {unassigned} parrots have no guild and never "
+                  f"reply. Use !parrot claim in the guild they belong to.")
+
+    async def claim_parrots(self, guild_id: int):
+        """
+        Gives the parrots without a guild to a guild, and reloads the
+        triggers if any moved.
+        :return: the number of parrots given to the guild.
+        """
+        assigned = await self.conn.request(
+            self.messages.sql_requests.assign_guild, (guild_id,) * 3)
+
+        if assigned and self.triggers_loaded:
+            self.triggers.clear()
+            self.trigger_index.clear()
+            self.triggers_loaded = False
+            await self.load_triggers()
+
+        return len(assigned)
+
+    def add_trigger(self, guild_id: int, trigger: str, parrot_id: int,
+                    alias: bool):
+        self.triggers[guild_id].add(trigger, parrot_id)
+        self.trigger_index[guild_id].add(trigger, parrot_id, alias)
+
+    def remove_trigger(self, guild_id: int, trigger: str):
+        self.triggers[guild_id].remove(trigger)
+        self.trigger_index[guild_id].remove(trigger)
+
+    def remove_parrot(self, guild_id: int, parrot_id: int):
+        self.triggers[guild_id].remove_parrot(parrot_id)
+        self.trigger_index[guild_id].remove_parrot(parrot_id)
+        self.responses.pop(parrot_id)
+        self.parrot_buckets.pop(parrot_id, None)
+
+    async def get_trigger(self, guild_id: int, name: str):
+        """
+        Finds the one trigger or alias in a guild a name refers to: the
+        trigger equal to it, or else the only trigger it is a prefix of.
+        """
+        await self.load_triggers()
+        index = self.trigger_index[guild_id]
+
+        name = name.lower()
+        if name in index:
+            return name
+
+        triggers = index.completions(name)
+        if len(triggers) > 1:
             raise ParrotError("multiple_parrots")
-        elif len(parrot_ids) == 1:
-            return parrot_ids[0]
+        if len(triggers) == 0:
+            raise ParrotError("parrot_not_found")
 
-        parrot_ids = sql_request(cursor,
-                                 requests.get_id,
-                                 (trigger + "%",))
+        return triggers[0]
+
+    async def get_parrot(self, guild_id: int, name: str):
+        """
+        Finds the parrot in a guild a name refers to: the one with a trigger
+        equal to it, or else the only one with a trigger it is a prefix of.
+        """
+        await self.load_triggers()
+        index = self.trigger_index[guild_id]
+
+        name = name.lower()
+        entry = index.get(name)
+        if entry is not None:
+            return entry[0]
+
+        parrot_ids = index.parrots(name)
         if len(parrot_ids) > 1:
             raise ParrotError("multiple_parrots")
         if len(parrot_ids) == 0:
             raise ParrotError("parrot_not_found")
 
-        return parrot_ids[0]
+        return parrot_ids.pop()
+
+    async def get_responses(self, parrot_id: int):
+        """
+        Gets the responses of a parrot, from memory if they are cached.
+        :return: a tuple of responses, empty if the parrot has none.
+        """
+        responses = self.responses.get(parrot_id)
+        if responses is None:
+            responses = tuple(await self.conn.request(
+                self.messages.sql_requests.get_responses, (parrot_id,)))
+            self.responses.put(parrot_id, responses)
+        return responses
+
+    async def load_disabled(self):
+        """
+        Fills the sets of guilds and channels parrots are turned off in from
+        the database.
+        """
+        requests = self.messages.sql_requests
+        self.disabled_guilds.update(
+            await self.conn.request(requests.disabled_guilds))
+        self.disabled_channels.update(
+            await self.conn.request(requests.disabled_channels))
 
     @commands.Cog.listener()
-    async def on_message(self, message):
-
+    async def on_ready(self):
+        await self.load_disabled()
+        await self.assign_guilds()
+        await self.load_triggers()
+
+    async def filter_message(self, message):
+        """
+        Decides whether a message could set off a parrot, cheapest checks
+        first, so that most chat never builds a command context or touches
+        the database.
+        :return: the name of the stage that rejected the message, or None if
+        it should be searched for triggers.
+        """
         if message.channel.type != discord.ChannelType.text:
-            return
-        if not self.toggle:
-            return
+            return "channel"
+        if message.guild.id in self.disabled_guilds:
+            return "disabled"
+        if message.channel.id in self.disabled_channels:
+            return "channel_disabled"
         if message.author == self.bot.user:
-            return
+            return "own"
+
+        # no trigger fits in anything shorter
+        if len(message.content) < MIN_TRIGGER_LEN:
+            return "length"
+
+        # only messages starting with the prefix can be commands
+        prefix = self.bot.command_prefix
+        if not isinstance(prefix, str) or message.content.startswith(prefix):
+            ctx = await self.bot.get_context(message)
+            if ctx.valid:
+                return "command"
+
+        return None
+
+    def get_bucket(self, buckets: dict, key: int, rate: float,
+                   burst: float):
+        """
+        Gets the TokenBucket under key in buckets, creating it if needed.
+        """
+        bucket = buckets.get(key)
+        if not bucket:
+            bucket = TokenBucket(rate, burst)
+            buckets[key] = bucket
+        return bucket
+
+    def stats(self):
+        """
+        :return: a dict of how many messages each stage of on_message let
+        through or stopped, logged by main's log_stats.
+        """
+        return dict(self.filter_counts)
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
 
-        ctx = await self.bot.get_context(message)
-        if ctx.valid:
+        stage = await self.filter_message(message)
+        if stage is not None:
+            self.filter_counts[stage] += 1
             return
 
         requests = self.messages.sql_requests
 
-        cursor = self.conn.cursor()
+        if self.triggers_loaded:
+            parrot_ids = self.triggers[message.guild.id].search(
+                message.content.lower())
+        else:
+            parrot_ids = await self.conn.request(requests.search_message,
+                                                 (message.guild.id,
+                                                  message.content.lower()))
+
+        if not parrot_ids:
+            self.filter_counts["no_match"] += 1
+            return
 
-        parrot_ids = sql_request(cursor,
-                                 requests.search_message,
-                                 (message.content.lower(),))
+        # check the channel without spending from it, so that parrots on
+        # cooldown do not use up the channel's replies
+        channel_bucket = self.get_bucket(
+            self.channel_buckets, message.channel.id,
+            CHANNEL_REPLY_RATE, CHANNEL_REPLY_BURST)
+        channel_bucket.refill()
+        if channel_bucket.tokens < 1:
+            self.filter_counts["channel_cooldown"] += 1
+            return
 
+        replies = []
+        length = 0
         for parrot_id in parrot_ids:
-            response = sql_request(cursor,
-                                   requests.random_response,
-                                   (parrot_id,))
-            if not response:
+            responses = await self.get_responses(parrot_id)
+            if not responses:
                 continue
-            response = response[0]
 
-            await message.channel.send(content=response)
+            reply = random.choice(responses)
+            # one message has to hold every reply
+            if length + len(reply) + 1 > MAX_MESSAGE_LEN:
+                break
+
+            if not self.get_bucket(self.parrot_buckets, parrot_id,
+                                   PARROT_REPLY_RATE,
+                                   PARROT_REPLY_BURST).consume():
+                continue
+
+            replies.append(reply)
+            length += len(reply) + 1
+
+        if not replies:
+            self.filter_counts["parrot_cooldown"] += 1
+            return
+
+        self.filter_counts["matched"] += 1
+        channel_bucket.consume()
+        await message.channel.send(content="\n".join(replies))
 
     @commands.group()
     @commands.check(non_dm)
@@ -110,24 +338,19 @@ class ParrotCog(commands.Cog):
             if len(response) > MAX_RESPONSE_LEN:
                 raise ParrotError("responses_too_long")
 
-        cursor = self.conn.cursor()
-
-        # check for existing ID
-        parrot_id = sql_request(cursor,
-                                requests.get_id,
-                                (trigger,))
-
-        if parrot_id:
+        try:
+            parrot_id = await self.conn.request(requests.new_parrot,
+                                                (ctx.guild.id, ctx.guild.id,
+                                                 trigger, trigger,
+                                                 list(responses)))
+        except psycopg2.IntegrityError:
+            # lost a race with another create of the same trigger
             raise ParrotError("parrot_exists")
 
-        parrot_id = sql_request(cursor, requests.new_parrot, ())[0]
-
-        cursor.execute(requests.insert_trigger,
-                       (parrot_id, trigger, False))
+        if not parrot_id:
+            raise ParrotError("parrot_exists")
 
-        for response in responses:
-            cursor.execute(requests.insert_response,
-                           (parrot_id, response))
+        self.add_trigger(ctx.guild.id, trigger, parrot_id[0], False)
 
         await send(ctx, style.success.format(trigger),
                    tag=True, expire=True)
@@ -138,38 +361,27 @@ class ParrotCog(commands.Cog):
         if len(args) != 1:
             raise WrongArgLength("one")
 
-        cursor = self.conn.cursor()
         requests = self.messages.sql_requests
         style = self.messages.style.delete
 
-        triggers = sql_request(cursor,
-                               requests.get_matching_triggers,
-                               (args[0],))[0]
-
-        if triggers.nummatches > 1:
-            raise ParrotError("multiple_parrots")
-        elif triggers.nummatches == 0:
-            triggers = sql_request(cursor,
-                                   requests.get_matching_triggers,
-                                   (args[0] + "%",))[0]
-            if triggers.nummatches > 1:
-                raise ParrotError("multiple_parrots")
-            elif triggers.nummatches == 0:
-                raise ParrotError("parrot_not_found")
+        trigger = await self.get_trigger(ctx.guild.id, args[0])
+        parrot_id, alias = self.trigger_index[ctx.guild.id].get(trigger)
 
-        if triggers.alias:
-            cursor.execute(requests.delete_alias,
-                           (triggers.trigger, triggers.parrotid))
+        if alias:
+            await self.conn.execute(requests.delete_alias,
+                                    (trigger, parrot_id))
+            self.remove_trigger(ctx.guild.id, trigger)
             await send(
                 ctx,
-                style.success_alias.format(triggers.trigger),
+                style.success_alias.format(trigger),
                 tag=True, expire=True)
         else:
-            cursor.execute(requests.delete_parrot,
-                           (triggers.parrotid,) * 3)
+            await self.conn.execute(requests.delete_parrot,
+                                    (parrot_id,) * 3)
+            self.remove_parrot(ctx.guild.id, parrot_id)
             await send(
                 ctx,
-                style.success.format(triggers.trigger),
+                style.success.format(trigger),
                 tag=True, expire=True)
 
     @parrot.command()
@@ -181,10 +393,10 @@ class ParrotCog(commands.Cog):
         requests = self.messages.sql_requests
         style = self.messages.style.view
 
-        parrot_id = self.get_parrot(args[0])
+        parrot_id = await self.get_parrot(ctx.guild.id, args[0])
 
-        cursor = self.conn.cursor()
-        view_params = sql_request(cursor, requests.get_view, (parrot_id,) * 3)
+        view_params = await self.conn.request(requests.get_view,
+                                              (parrot_id,) * 3)
 
         if len(view_params) == 0:
             raise ParrotError("parrot_not_found")
@@ -212,13 +424,21 @@ class ParrotCog(commands.Cog):
     @parrot.command()
     async def list(self, ctx: commands.context, *args):
 
-        requests = self.messages.sql_requests
         style = self.messages.style.list
-        cursor = self.conn.cursor()
 
-        parrots = sql_request(cursor, requests.all_parrots, ())
+        if len(args) > 1:
+            raise WrongArgLength("zero or one")
+
+        await self.load_triggers()
+
+        index = self.trigger_index[ctx.guild.id]
+        prefix = args[0].lower() if args else ""
+        parrots = [trigger for trigger in index.completions(prefix)
+                   if not index.get(trigger)[1]]
 
         if not parrots:
+            if prefix:
+                raise ParrotError("parrot_not_found")
             raise ParrotError("no_parrots")
 
         embed = discord.Embed(
@@ -227,10 +447,12 @@ class ParrotCog(commands.Cog):
             description="\n".join(parrots)
         )
 
-        if self.toggle:
-            embed.set_footer(text=style.footer_on)
-        else:
+        if ctx.guild.id in self.disabled_guilds:
             embed.set_footer(text=style.footer_off)
+        elif ctx.channel.id in self.disabled_channels:
+            embed.set_footer(text=style.footer_channel_off)
+        else:
+            embed.set_footer(text=style.footer_on)
 
         await ctx.send(embed=embed)
 
@@ -243,7 +465,7 @@ class ParrotCog(commands.Cog):
         if len(args) != 2:
             raise WrongArgLength("two")
 
-        parrot_id = self.get_parrot(args[0])
+        parrot_id = await self.get_parrot(ctx.guild.id, args[0])
 
         alias = args[1].lower()
         if len(alias) < MIN_TRIGGER_LEN:
@@ -251,33 +473,63 @@ class ParrotCog(commands.Cog):
         if len(alias) > MAX_TRIGGER_LEN:
             raise ParrotError("alias_too_long")
 
-        cursor = self.conn.cursor()
-
         # check that there are no other exact matches for that alias,
         # since multiple exact aliases leads to ambiguity
-        matching_triggers = sql_request(cursor,
-                                        requests.get_matching_triggers,
-                                        (alias,))[0]
-        if matching_triggers.nummatches > 0:
+        if alias in self.trigger_index[ctx.guild.id]:
             raise ParrotError("alias_exists")
 
-        cursor.execute(requests.insert_trigger, (parrot_id, alias, True))
+        try:
+            await self.conn.execute(requests.insert_trigger,
+                                    (parrot_id, alias, True, ctx.guild.id))
+        except psycopg2.IntegrityError:
+            raise ParrotError("alias_exists")
+        self.add_trigger(ctx.guild.id, alias, parrot_id, True)
         await send(ctx,
                    style.success.format(alias),
                    tag=True, expire=True)
 
     @parrot.command()
     async def toggle(self, ctx: commands.context, *args):
-        self.toggle = not self.toggle
+
+        if len(args) > 1:
+            raise WrongArgLength("zero or one")
+
+        if args:
+            if args[0].lower() != "here":
+                raise ParrotError("toggle_invalid")
+            await self.toggle_channel(ctx)
+            return
+
+        requests = self.messages.sql_requests
         style = self.messages.style.toggle
-        if self.toggle:
-            await send(ctx,
-                       style.enable,
-                       tag=True, expire=True)
+
+        guild_id = ctx.guild.id
+        if guild_id in self.disabled_guilds:
+            await self.conn.execute(requests.enable_guild, (guild_id,))
+            self.disabled_guilds.discard(guild_id)
+            await send(ctx, style.enable, tag=True, expire=True)
         else:
-            await send(ctx,
-                       style.disable,
-                       tag=True, expire=True)
+            await self.conn.execute(requests.disable_guild, (guild_id,))
+            self.disabled_guilds.add(guild_id)
+            await send(ctx, style.disable, tag=True, expire=True)
+
+    async def toggle_channel(self, ctx: commands.context):
+        """
+        Turns parrots on or off in the channel of ctx alone.
+        """
+        requests = self.messages.sql_requests
+        style = self.messages.style.toggle
+
+        channel_id = ctx.channel.id
+        if channel_id in self.disabled_channels:
+            await self.conn.execute(requests.enable_channel, (channel_id,))
+            self.disabled_channels.discard(channel_id)
+            await send(ctx, style.enable_channel, tag=True, expire=True)
+        else:
+            await self.conn.execute(requests.disable_channel,
+                                    (channel_id, ctx.guild.id))
+            self.disabled_channels.add(channel_id)
+            await send(ctx, style.disable_channel, tag=True, expire=True)
 
     @parrot.group()
     async def response(self, ctx: commands.context):
@@ -296,12 +548,14 @@ class ParrotCog(commands.Cog):
         requests = self.messages.sql_requests
         style = self.messages.style.response_add
 
-        parrot_id = self.get_parrot(args[0])
+        parrot_id = await self.get_parrot(ctx.guild.id, args[0])
 
-        cursor = self.conn.cursor()
+        await self.conn.execute(requests.insert_response,
+                                (parrot_id, args[1]))
 
-        cursor.execute(requests.insert_response,
-                       (parrot_id, args[1]))
+        responses = self.responses.pop(parrot_id)
+        if responses is not None:
+            self.responses.put(parrot_id, responses + (args[1],))
 
         await send(ctx,
                    style.success.format(args[1]),
@@ -313,32 +567,35 @@ class ParrotCog(commands.Cog):
         if len(args) != 2:
             raise WrongArgLength("two")
 
-        parrot_id = self.get_parrot(args[0])
+        parrot_id = await self.get_parrot(ctx.guild.id, args[0])
 
         requests = self.messages.sql_requests
         style = self.messages.style.response_remove
 
         response = args[1].lower()
 
-        cursor = self.conn.cursor()
-
-        deleted = sql_request(cursor,
-                              requests.delete_response,
-                              (response + "%", parrot_id, parrot_id))
+        deleted = await self.conn.request(requests.delete_response,
+                                          (response + "%", parrot_id,
+                                           parrot_id))
 
         if len(deleted) == 0:
             raise ParrotError("response_not_found")
 
         deleted = deleted[0]
 
-        num_responses = sql_request(cursor,
-                                    requests.num_responses,
-                                    (parrot_id,))[0]
+        responses = self.responses.pop(parrot_id)
+        if responses is not None:
+            self.responses.put(parrot_id, tuple(
+                i for i in responses if i != deleted))
+
+        num_responses = (await self.conn.request(requests.num_responses,
+                                                 (parrot_id,)))[0]
         if num_responses == 0:
-            cursor.execute(
+            await self.conn.execute(
                 requests.delete_parrot,
                 (parrot_id,) * 3
             )
+            self.remove_parrot(ctx.guild.id, parrot_id)
             await send(ctx, style.parrot_deleted.format(deleted),
                        tag=True, expire=True)
             return
@@ -346,8 +603,11 @@ class ParrotCog(commands.Cog):
         await send(ctx, style.success.format(deleted), tag=True,
                    expire=True)
 
-    @parrot.command()
-    async def reset(self, ctx: commands.context, *args):
+    async def confirm_password(self, ctx: commands.context):
+        """
+        Asks the author of ctx for the reset password over DM.
+        :return: whether they entered it in time.
+        """
         style = self.messages.style.password
 
         await send_dm(ctx.author, style.password_enter)
@@ -360,8 +620,40 @@ class ParrotCog(commands.Cog):
                                 x.author == ctx.author and
                                 x.content == os.environ['RESET_PASSWORD'])
         except asyncio.TimeoutError:
+            return False
+        return True
+
+    @parrot.command()
+    async def reset(self, ctx: commands.context, *args):
+        style = self.messages.style.password
+
+        if not await self.confirm_password(ctx):
             await send_dm(ctx.author, style.password_fail)
-        else:
-            cursor = self.conn.cursor()
-            cursor.execute(self.messages.sql_requests.reset)
-            await send_dm(ctx.author, style.password_succeed)
+            return
+
+        # only this guild's parrots
+        deleted = await self.conn.request(
+            self.messages.sql_requests.reset, (ctx.guild.id,))
+        self.triggers.pop(ctx.guild.id, None)
+        self.trigger_index.pop(ctx.guild.id, None)
+        for parrot_id in deleted:
+            self.responses.pop(parrot_id)
+            self.parrot_buckets.pop(parrot_id, None)
+        await send_dm(ctx.author, style.password_succeed)
+
+    @parrot.command()
+    async def claim(self, ctx: commands.context, *args):
+        """
+        Gives the parrots made before guilds were stored to this guild, for
+        when the bot is in more than one and could not place them itself.
+        """
+        style = self.messages.style.claim
+
+        if not await self.confirm_password(ctx):
+            await send_dm(ctx.author, style.fail)
+            return
+
+        claimed = await self.claim_parrots(ctx.guild.id)
+        unassigned = (await self.conn.request(
+            self.messages.sql_requests.unassigned_parrots))[0]
+        await send_dm(ctx.author, style.success.format(claimed, unassigned))
@@ -1,13 +1,42 @@
 import discord, os, asyncio
-from discord.ext import commands
+from discord.ext import commands, tasks
 from src.base import *
-from datetime import datetime
+from src.cache import LRUCache
+from src.ratelimit import TokenBucket
+from collections import OrderedDict
+from datetime import datetime, timedelta
 import box
 import arrow
+import math
+import time
+import traceback
 
 MAX_QUESTION_LENGTH = 255
 MAX_OPTION_LENGTH = 80
 POLLS_PER_PAGE = 10
+# Polls.PollID is a serial
+MAX_POLL_ID = 2 ** 31 - 1
+
+# seconds that !poll list listens for page turns
+LIST_TIMEOUT = 60
+# seconds before the cached poll count is refreshed from the database
+POLL_COUNT_TTL = 10 * 60
+
+# seconds to wait for more votes before re-rendering a poll
+EDIT_WINDOW = 1.0
+
+# discord allows one reaction every quarter second per channel
+REACTION_RATE = 4
+REACTION_BURST = 1
+
+# polls untouched for this many days are moved to the archive
+ARCHIVE_AFTER_DAYS = 60
+ARCHIVE_INTERVAL_HOURS = 6
+ARCHIVE_BATCH = 100
+
+# how many polls to keep tallies in memory for, and for how long (seconds)
+TALLY_CACHE_SIZE = 64
+TALLY_CACHE_IDLE = 60 * 60
 
 
 class PollError(CommandError):
@@ -16,14 +45,214 @@ class PollError(CommandError):
         self.message = message
 
 
+class EditScheduler(object):
+    """
+    Merges bursts of edits to the same message into one edit per window.
+    The content is rendered only when the window closes, so whatever the
+    last change was is always what gets published, and a change that comes
+    in while an edit is in flight starts another window.
+    """
+
+    def __init__(self, window: float = EDIT_WINDOW):
+        self.window = window
+        self.pending = {}
+        self.tasks = {}
+
+        self.requested = 0
+        self.performed = 0
+
+    @property
+    def saved(self):
+        """
+        The number of edits that were merged into another instead of being
+        made.
+        """
+        return self.requested - self.performed
+
+    def schedule(self, key, message: discord.Message, render):
+        """
+        Queues an edit of message.
+        :param key: edits sharing a key are merged.
+        :param message: the message to edit.
+        :param render: a coroutine function returning the new content.
+        """
+        self.requested += 1
+        self.pending[key] = (message, render)
+        if key not in self.tasks:
+            self.tasks[key] = asyncio.ensure_future(self.flush(key))
+
+    async def flush(self, key):
+        try:
+            while key in self.pending:
+                await asyncio.sleep(self.window)
+                message, render = self.pending.pop(key)
+                try:
+                    content = await render()
+                    self.performed += 1
+                    await message.edit(content=content)
+                except discord.NotFound:
+                    pass
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # keep going, so that a later change still gets out
+                    print(f"EditScheduler: edit of {key} failed:")
+                    traceback.print_exc()
+        finally:
+            del self.tasks[key]
+
+
+class NameCache(object):
+    """
+    Display names of guild members, by guild and user ID. Members who have
+    left the guild are looked up through the API, all at once, and are
+    remembered by username. Entries are dropped when a member is updated
+    or leaves.
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        # guild id -> {user id -> name, or None for deleted users}
+        self.guilds = {}
+
+    def invalidate(self, guild_id: int, user_id: int):
+        names = self.guilds.get(guild_id)
+        if names:
+            names.pop(user_id, None)
+
+    def invalidate_user(self, user_id: int):
+        for names in self.guilds.values():
+            names.pop(user_id, None)
+
+    async def fetch(self, user_id: int):
+        user = self.bot.get_user(user_id)
+        if user is None:
+            try:
+                user = await self.bot.fetch_user(user_id)
+            except discord.NotFound:
+                return None
+        return user.name
+
+    async def get(self, guild: discord.Guild, user_ids):
+        """
+        :param guild: the guild to get display names in.
+        :param user_ids: the users to get names for.
+        :return: a dict of user ID to name, with None for deleted users.
+        Users who could not be looked up this time are left out, and are
+        tried again on the next call.
+        """
+        names = self.guilds.setdefault(guild.id, {})
+
+        missing = set()
+        for user_id in user_ids:
+            if user_id in names:
+                continue
+            member = guild.get_member(user_id)
+            if member:
+                names[user_id] = member.display_name
+            else:
+                missing.add(user_id)
+
+        if missing:
+            missing = list(missing)
+            # one failed lookup must not cancel the others or fail the poll
+            fetched = await asyncio.gather(
+                *(self.fetch(user_id) for user_id in missing),
+                return_exceptions=True)
+            for user_id, name in zip(missing, fetched):
+                if isinstance(name, discord.HTTPException):
+                    print(f"NameCache: looking up user {user_id} failed: "
+                          f"{name}")
+                elif isinstance(name, BaseException):
+                    raise name
+                else:
+                    names[user_id] = name
+
+        return names
+
+
+class TallyOption(object):
+    __slots__ = ('emoji', 'option', 'voters')
+
+    def __init__(self, emoji: str, option: str, voters: list):
+        self.emoji = emoji
+        self.option = option
+        self.voters = voters
+
+
+class Tally(object):
+    """
+    An in-memory copy of one poll's readout: the question, its author, and
+    the emoji, text and voters of each option. Votes are applied in place so
+    that re-rendering a busy poll never has to go back to the database.
+    """
+
+    def __init__(self, question: str, username, options):
+        self.question = question
+        self.username = username
+
+        # option id -> TallyOption, in creation order
+        self.options = OrderedDict()
+        self.emojis = {}
+        for option_id, option in sorted(options.items()):
+            self.options[option_id] = option
+            self.emojis[option.emoji] = option_id
+
+    def vote(self, option_id: int, user, add: bool):
+        voters = self.options[option_id].voters
+        if user in voters:
+            voters.remove(user)
+        if add:
+            voters.append(user)
+
+    def readout(self):
+        """
+        :return: the options, ordered from most to fewest votes.
+        """
+        return sorted(self.options.values(),
+                      key=lambda option: -len(option.voters))
+
+
 class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
 
     def __init__(self, poll_file: str,
-                 conn, bot: commands.Bot):
+                 conn, bot: commands.Bot, edit_window: float = EDIT_WINDOW):
         self.bot = bot
         self.conn = conn
+        self.edits = EditScheduler(edit_window)
+
+        # message IDs of every live poll, so that reactions on anything else
+        # can be dropped without touching the database or the REST API.
+        # filled in on_ready, and kept current by create/revive/delete.
+        self.poll_messages = set()
+        self.poll_messages_loaded = False
+        # message id -> poll id of archived polls, whose messages may still
+        # be voted on; loaded and kept current along with poll_messages
+        self.archived_messages = {}
+
+        # guild id -> [poll count, time it was counted]
+        self.poll_counts = {}
+
+        # poll id -> [reactions added, reactions to add] while seeding
+        self.seeding = {}
+        # the seed_reactions tasks running, so they are not lost
+        self.seeders = set()
+        # channel id -> TokenBucket for adding reactions
+        self.reaction_buckets = {}
+
+        self.names = NameCache(bot)
+
+        self.archive.start()
+
+        # poll id -> Tally
+        self.tallies = LRUCache(TALLY_CACHE_SIZE, TALLY_CACHE_IDLE)
+        # poll id -> future of the Tally being loaded, so that a burst of
+        # votes on an uncached poll all share (and vote on) one Tally
+        self.tally_loads = {}
         with open(poll_file, 'r') as msg_file:
             self.messages = box.Box.from_yaml(msg_file)
+        conn.statements.register(self.messages.component,
+                                 self.messages.sql_requests)
 
     @staticmethod
     def emoji_to_str(flake: str):
@@ -33,40 +262,96 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
     def str_to_emoji(emoji: str):
         return chr(int(emoji, base=16))
 
-    @staticmethod
-    def snowflake_to_str(flake: int):
-        return "{0:016X}".format(flake)
-
-    @staticmethod
-    def snowflake_to_user(guild: discord.Guild, flake: str):
-        return guild.get_member(user_id=int(flake, 16)).display_name
+    async def get_names(self, guild: discord.Guild, user_ids):
+        """
+        Gets the display names of a list of users, in the same order.
+        """
+        names = await self.names.get(guild, user_ids)
+        unknown = self.messages.style.readout.unknown_user
+        return [names.get(user_id) or unknown for user_id in user_ids]
+
+    async def get_tally(self, poll_id: int):
+        """
+        Gets the cached tally of a poll, loading it from the database if
+        it is not in memory. Concurrent callers wait on the same load.
+        :param poll_id: the poll to get.
+        :return: the poll's Tally, or None if the poll does not exist.
+        """
+        tally = self.tallies.get(poll_id)
+        if tally:
+            return tally
+
+        loading = self.tally_loads.get(poll_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self.load_tally(poll_id))
+            self.tally_loads[poll_id] = loading
+            loading.add_done_callback(
+                lambda future: self.tally_loaded(poll_id, future))
+
+        # one caller giving up must not cancel the load for the others
+        return await asyncio.shield(loading)
+
+    def tally_loaded(self, poll_id: int, loading: asyncio.Future):
+        # a load that was forgotten part way through may be out of date
+        if self.tally_loads.get(poll_id) is not loading:
+            return
+        del self.tally_loads[poll_id]
 
-    @staticmethod
-    def str_to_snowflake(flake: str):
-        return int(flake, 16)
+        if not loading.cancelled() and loading.exception() is None and \
+                loading.result() is not None:
+            self.tallies.put(poll_id, loading.result())
 
-    def get_option_string(self, guild: discord.Guild, poll_id: int):
+    def forget_tally(self, poll_id: int):
+        """
+        Drops a poll's tally, and any load of it in progress, after a change
+        that votes alone don't cover.
+        """
+        self.tallies.pop(poll_id)
+        self.tally_loads.pop(poll_id, None)
 
+    async def load_tally(self, poll_id: int):
         requests = self.messages.sql_requests
-        style = self.messages.style.readout
 
-        cursor = self.conn.cursor()
+        async with self.conn.lease() as db:
+            poll_info = await db.request(requests.get_poll, (poll_id,))
+            if not poll_info:
+                return None
+            poll_info = poll_info[0]
+
+            options = await db.request(requests.readout, (poll_id,))
+
+        options = {
+            option.optionid: TallyOption(
+                option.emoji, option.option,
+                option.votes)
+            for option in options
+        }
+
+        return Tally(poll_info.question, poll_info.username, options)
 
-        # get option info, ordered from most to fewest votes
-        options = sql_request(cursor,
-                              requests.readout, (poll_id,))
+    async def get_option_string(self, guild: discord.Guild, poll_id: int):
+
+        style = self.messages.style.readout
+
+        tally = await self.get_tally(poll_id)
+        if tally is None:
+            return style.poll_deleted
 
         option_strings = []
 
-        # get option readout
-        for option in options:
+        # look everyone up at once, so departed voters are fetched together
+        await self.names.get(guild, [user
+                                     for option in tally.options.values()
+                                     for user in option.voters])
+
+        # get option readout, ordered from most to fewest votes
+        for option in tally.readout():
 
             emoji = self.str_to_emoji(option.emoji)
 
             # get votes
-            if option.votes:
-                users = option.votes.split(" ")
-                users = [self.snowflake_to_user(guild, user) for user in users]
+            if option.voters:
+                users = await self.get_names(guild, option.voters)
                 all_votes = ", ".join(users)
             else:
                 all_votes = style.no_votes
@@ -74,44 +359,232 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
             # format options string
 
             vote_str = style.vote_plural
-            if option.votecount == 1:
+            if len(option.voters) == 1:
                 vote_str = style.vote_singular
 
             final_string = style.option_string.format(
-                option.votecount, vote_str, emoji, option.option, all_votes)
+                len(option.voters), vote_str, emoji, option.option, all_votes)
 
             option_strings.append(final_string)
 
         return "\n".join(option_strings)
 
-    def get_poll_string(self, guild: discord.Guild, poll_id):
+    async def get_poll_string(self, guild: discord.Guild, poll_id):
 
         style = self.messages.style.readout
-        requests = self.messages.sql_requests
-
-        cursor = self.conn.cursor()
 
         # get poll info
-        poll_info = sql_request(cursor,
-                                requests.get_poll,
-                                (poll_id,))[0]
+        poll_info = await self.get_tally(poll_id)
+        if poll_info is None:
+            return style.poll_deleted
 
-        username = self.snowflake_to_user(guild, poll_info.username)
+        username = (await self.get_names(guild, [poll_info.username]))[0]
 
         # format strings
         header_string = style.poll_header.format(poll_id,
                                                  username)
         question_string = style.question_string.format(poll_info.question)
 
-        option_string = self.get_option_string(guild, poll_id)
+        option_string = await self.get_option_string(guild, poll_id)
+
+        strings = [header_string, question_string, option_string]
+
+        if poll_id in self.seeding:
+            strings.append(style.seeding.format(*self.seeding[poll_id]))
 
         # join string together :)
-        ret = "\n".join([header_string, question_string, option_string])
+        ret = "\n".join(strings)
         if len(ret) >= MAX_TEXT_LENGTH:
             return style.poll_overflow
 
         return ret
 
+    def get_reaction_bucket(self, channel: discord.TextChannel):
+        """
+        Gets the TokenBucket that paces reaction changes in a channel.
+        """
+        bucket = self.reaction_buckets.get(channel.id)
+        if not bucket:
+            bucket = TokenBucket(REACTION_RATE, REACTION_BURST)
+            self.reaction_buckets[channel.id] = bucket
+        return bucket
+
+    async def seed_reactions(self, message: discord.Message, poll_id: int,
+                             emojis):
+        """
+        Adds the option reactions to a poll that is already on display, as
+        fast as the channel's reaction rate limit allows, with the progress
+        shown in the readout. Gives up quietly if the message is deleted,
+        and with a log line if discord refuses a reaction.
+        :param message: the poll message.
+        :param poll_id: the poll's ID.
+        :param emojis: the option emojis to add, as stored in the database.
+        """
+        bucket = self.get_reaction_bucket(message.channel)
+
+        def render():
+            return self.get_poll_string(message.guild, poll_id)
+
+        progress = [0, len(emojis)]
+        self.seeding[poll_id] = progress
+        try:
+            for emoji in emojis:
+                await bucket.wait()
+                await message.add_reaction(self.str_to_emoji(emoji))
+                progress[0] += 1
+                self.edits.schedule(poll_id, message, render)
+        except discord.NotFound:
+            return
+        except discord.HTTPException as error:
+            # missing permissions, or the message is at the reaction limit;
+            # the readout still has to stop showing progress
+            print(f"seed_reactions: seeding poll {poll_id} stopped: {error}")
+        finally:
+            # a revive may have started seeding a new message since
+            if self.seeding.get(poll_id) is progress:
+                del self.seeding[poll_id]
+
+        self.edits.schedule(poll_id, message, render)
+
+    def start_seeding(self, message: discord.Message, poll_id: int, emojis):
+        """
+        Runs seed_reactions in the background, keeping hold of its task.
+        """
+        task = asyncio.ensure_future(
+            self.seed_reactions(message, poll_id, emojis))
+        self.seeders.add(task)
+        task.add_done_callback(self.seeders.discard)
+
+    def stats(self):
+        """
+        :return: a dict of how many readout edits were asked for, made, and
+        saved by merging.
+        """
+        return {
+            "edits_requested": self.edits.requested,
+            "edits_performed": self.edits.performed,
+            "edits_saved": self.edits.saved,
+        }
+
+    def cog_unload(self):
+        self.archive.cancel()
+        for task in self.seeders:
+            task.cancel()
+
+    @tasks.loop(hours=ARCHIVE_INTERVAL_HOURS)
+    async def archive(self):
+        """
+        Moves polls that nobody has touched in ARCHIVE_AFTER_DAYS days, along
+        with their options and votes, out of the live tables and into
+        PollArchive, so they stop weighing on every query. Commands naming
+        an archived poll, and votes on its message, bring it back.
+        """
+        requests = self.messages.sql_requests
+        cutoff = datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+        # tasks.loop only restarts after network errors, so anything else,
+        # a database error included, would end archiving for good
+        try:
+            while True:
+                archived = await self.conn.request(requests.archive_polls,
+                                                   (cutoff, ARCHIVE_BATCH))
+                for poll in archived:
+                    self.poll_messages.discard(poll.message)
+                    self.archived_messages[poll.message] = poll.pollid
+                    self.forget_tally(poll.pollid)
+                    self.count_polls(poll.guildid, -1)
+
+                if len(archived) < ARCHIVE_BATCH:
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            print("archive: archiving polls failed; trying again in "
+                  f"{ARCHIVE_INTERVAL_HOURS} hours:")
+            traceback.print_exc()
+
+    @archive.before_loop
+    async def before_archive(self):
+        await self.bot.wait_until_ready()
+
+    async def restore_poll(self, poll_id: int, guild_id: int):
+        """
+        Moves a poll back out of the archive.
+        :param poll_id: the poll to restore.
+        :param guild_id: the guild the poll has to belong to.
+        :return: True if the poll was archived and has been restored.
+        """
+        restored = await self.conn.request(
+            self.messages.sql_requests.restore_poll,
+            (poll_id, guild_id, guild_id, datetime.utcnow(), guild_id))
+
+        if not restored:
+            return False
+
+        self.poll_messages.add(restored[0])
+        self.archived_messages.pop(restored[0], None)
+        self.count_polls(guild_id, 1)
+        return True
+
+    async def request_restoring(self, call: str, args, poll_id: int,
+                                guild_id: int):
+        """
+        Runs a query about one poll, and if it finds nothing, restores the
+        poll from the archive and runs it again.
+        :param call: the query.
+        :param args: its arguments.
+        :param poll_id: the poll it is about.
+        :param guild_id: the guild the poll has to belong to.
+        :return: what the query returned.
+        """
+        result = await self.conn.request(call, args)
+        if not result and await self.restore_poll(poll_id, guild_id):
+            result = await self.conn.request(call, args)
+        return result
+
+    async def assign_guilds(self):
+        """
+        Records the guild of polls made before guilds were stored, going by
+        the guild their channel is in. Polls in channels the bot can no
+        longer see are left alone.
+        """
+        requests = self.messages.sql_requests
+
+        channels = await self.conn.request(requests.unassigned_channels)
+        for channel_id in channels:
+            channel = self.bot.get_channel(channel_id)
+            if channel is None or not hasattr(channel, 'guild'):
+                continue
+            await self.conn.execute(requests.assign_guild,
+                                    (channel.guild.id, channel_id))
+            self.poll_counts.pop(channel.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await self.assign_guilds()
+
+        requests = self.messages.sql_requests
+
+        messages = await self.conn.request(requests.poll_messages)
+        self.poll_messages |= set(messages)
+        archived = await self.conn.request(requests.archived_messages)
+        for poll in archived:
+            self.archived_messages.setdefault(poll.message, poll.pollid)
+        self.poll_messages_loaded = True
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member,
+                               after: discord.Member):
+        self.names.invalidate(after.guild.id, after.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        self.names.invalidate(member.guild.id, member.id)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        self.names.invalidate_user(after.id)
+
     # REACTION HANDLERS
     # Using on_raw_reaction_x here instead of on_reaction_x so that the bot
     # will still process polls after a restart, when the internal cache is
@@ -120,28 +593,37 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
 
         requests = self.messages.sql_requests
 
-        guild = self.bot.get_guild(payload.guild_id)
-        channel = guild.get_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
-        user = guild.get_member(payload.user_id)
+        # if a reaction was added to a non-poll, ignore it
+        if self.poll_messages_loaded and \
+                payload.message_id not in self.poll_messages and \
+                payload.message_id not in self.archived_messages:
+            return
 
-        if user == self.bot.user:
+        if payload.user_id == self.bot.user.id:
             return
 
-        cursor = self.conn.cursor()
+        # a vote brings an archived poll back, as the poll commands do
+        archived = self.archived_messages.get(payload.message_id)
+        if archived is not None:
+            await self.restore_poll(archived, payload.guild_id)
 
         # get poll
-        poll = sql_request(cursor,
-                           requests.get_id_from_message,
-                           (datetime.utcnow(),
-                            self.snowflake_to_str(payload.message_id),
-                            self.snowflake_to_str(payload.channel_id)))
+        poll = await self.conn.request(
+            requests.get_id_from_message,
+            (datetime.utcnow(),
+             payload.message_id, payload.channel_id))
 
-        # if a reaction was added to a non-poll, ignore it
         if not poll:
+            self.poll_messages.discard(payload.message_id)
+            self.archived_messages.pop(payload.message_id, None)
             return
         poll = poll[0]
 
+        guild = self.bot.get_guild(payload.guild_id)
+        channel = guild.get_channel(payload.channel_id)
+        message = await channel.fetch_message(payload.message_id)
+        user = guild.get_member(payload.user_id)
+
         # custom emojis are not allowed on polls
         if not payload.emoji.is_unicode_emoji():
             await message.remove_reaction(payload.emoji, user)
@@ -156,25 +638,25 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
         emoji = self.emoji_to_str(payload.emoji.name)
 
         # get option
-        option = sql_request(cursor, requests.option_from_emoji,
-                             (poll, emoji))
+        tally = await self.get_tally(poll)
+        option = tally.emojis.get(emoji) if tally else None
 
         # emoji not a real option--remove it
-        if not option:
+        if option is None:
             await message.remove_reaction(payload.emoji, user)
             return
-        option = option[0]
 
-        # remove old vote
-        cursor.execute(requests.remove_vote,
-                       (self.snowflake_to_str(payload.user_id), option))
-
-        # add new vote
         if add:
-            cursor.execute(requests.add_vote,
-                           (self.snowflake_to_str(payload.user_id), option))
+            await self.conn.execute(requests.add_vote,
+                                    (payload.user_id, option))
+        else:
+            await self.conn.execute(requests.remove_vote,
+                                    (payload.user_id, option))
 
-        await message.edit(content=self.get_poll_string(guild, poll))
+        tally.vote(option, payload.user_id, add)
+
+        self.edits.schedule(poll, message,
+                            lambda: self.get_poll_string(guild, poll))
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self,
@@ -217,35 +699,32 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
         message = await send(ctx, self.messages.style.readout.loading,
                              tag=False, expire=False)
 
-        message_flake = self.snowflake_to_str(message.id)
-        channel_flake = self.snowflake_to_str(ctx.channel.id)
-        user_flake = self.snowflake_to_str(ctx.author.id)
-
-        # catch question-too-long and options_too_long errors
-
-        cursor = self.conn.cursor()
-
-        cursor.execute(requests.new_poll,
-                       (question, user_flake, datetime.utcnow(),
-                        datetime.utcnow(), message_flake, channel_flake))
-
-        poll_id = cursor.fetchone()[0]
-
         if len(args) == 1:
-            options = zip(self.messages.default_poll.options,
-                          self.messages.default_poll.emojis)
+            options = list(zip(self.messages.default_poll.options,
+                               self.messages.default_poll.emojis))
         else:
-            options = zip(args[1:],
-                          self.messages.emojis)
+            options = list(zip(args[1:],
+                               self.messages.emojis))
+
+        emojis = [emoji for _, emoji in options]
 
-        for option, emoji in options:
-            cursor.execute(requests.new_option,
-                           (poll_id, True, user_flake, emoji, option))
-            await message.add_reaction(self.str_to_emoji(emoji))
+        poll_id = (await self.conn.request(
+            requests.new_poll,
+            (question, ctx.author.id, datetime.utcnow(),
+             datetime.utcnow(), message.id, ctx.channel.id, ctx.guild.id,
+             emojis, [option for option, _ in options])))[0]
 
-        message_string = self.get_poll_string(ctx.guild, poll_id)
+        self.poll_messages.add(message.id)
+        self.count_polls(ctx.guild.id, 1)
+
+        # show the poll right away; votes count as soon as it's up, even on
+        # options whose reactions haven't been added yet
+        self.seeding[poll_id] = [0, len(emojis)]
+        message_string = await self.get_poll_string(ctx.guild, poll_id)
         await message.edit(content=message_string)
 
+        self.start_seeding(message, poll_id, emojis)
+
     ############################################################################
     # append
     ############################################################################
@@ -264,16 +743,16 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
         except ValueError:
             raise ArgIsNaN("id")
 
-        cursor = self.conn.cursor()
-
-        poll_info = sql_request(cursor, requests.get_message_from_id,
-                                (datetime.utcnow(), poll_id))
+        poll_info = await self.request_restoring(
+            requests.get_message_from_id,
+            (datetime.utcnow(), poll_id, ctx.guild.id),
+            poll_id, ctx.guild.id)
         if not poll_info:
             raise PollError("poll_not_found")
 
         poll_info = poll_info[0]
 
-        emojis = sql_request(cursor, requests.get_emojis, (poll_id,))
+        emojis = await self.conn.request(requests.get_emojis, (poll_id,))
 
         if len(emojis) == 0:
             raise PollError("options_not_found")
@@ -290,83 +769,166 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
         else:
             raise PollError("too_many_options")
 
-        cursor.execute(self.messages.sql_requests.new_option,
-                       (poll_id, False, self.snowflake_to_str(ctx.author.id),
-                        emoji, option))
+        await self.conn.execute(requests.new_option,
+                                (poll_id, False, ctx.author.id,
+                                 emoji, option))
+        self.forget_tally(poll_id)
 
-        channel = ctx.guild.get_channel(
-            self.str_to_snowflake(poll_info.channel)
-        )
+        channel = ctx.guild.get_channel(poll_info.channel)
         if not channel:
             raise PollError("poll_deleted")
         try:
-            message = await ctx.fetch_message(
-                self.str_to_snowflake(poll_info.message))
+            message = await ctx.fetch_message(poll_info.message)
         except discord.NotFound:
             raise PollError("poll_deleted")
 
-        await message.edit(content=self.get_poll_string(ctx.guild, poll_id))
+        await message.edit(
+            content=await self.get_poll_string(ctx.guild, poll_id))
         await message.add_reaction(self.str_to_emoji(emoji))
 
     ############################################################################
     # list
     ############################################################################
 
+    def count_polls(self, guild_id: int, change: int):
+        """
+        Keeps a guild's cached poll count current as polls come and go.
+        """
+        count = self.poll_counts.get(guild_id)
+        if count:
+            count[0] += change
+
+    async def get_num_pages(self, guild_id: int):
+        """
+        Gets the number of pages of a guild's polls. The poll count is cached,
+        and kept roughly current by create and delete in between refreshes.
+        """
+        now = time.monotonic()
+        count = self.poll_counts.get(guild_id)
+        if count is None or now - count[1] > POLL_COUNT_TTL:
+            count = [(await self.conn.request(
+                self.messages.sql_requests.poll_count, (guild_id,)))[0], now]
+            self.poll_counts[guild_id] = count
+
+        return math.ceil(count[0] / POLLS_PER_PAGE)
+
+    async def get_summaries(self, guild_id: int, older_than=None,
+                            newer_than=None):
+        """
+        Gets a page of a guild's poll summaries, newest first, keyed on poll
+        ID so that every page costs the same no matter how deep it is.
+        :param guild_id: the guild to list the polls of.
+        :param older_than: get the page of polls with IDs at most this.
+        :param newer_than: get the page of polls with IDs at least this.
+        """
+        requests = self.messages.sql_requests
+        style = self.messages.style.list
+
+        if newer_than is None:
+            return await self.conn.request(
+                requests.summary_older,
+                (style.no_votes, guild_id, older_than, POLLS_PER_PAGE))
+
+        return await self.conn.request(
+            requests.summary_newer,
+            (style.no_votes, guild_id, newer_than, POLLS_PER_PAGE))
+
+    def get_list_embed(self, summaries, num_pages: int):
+
+        style = self.messages.style.list
+
+        format_string = style.summary_string
+        summary_string = "\n".join(
+            format_string.format(str(i.pollid).zfill(3), i.question, i.result)
+            for i in summaries
+        )
+
+        embed = discord.Embed(
+            color=random_color(),
+            title=style.title,
+            description=summary_string
+        )
+
+        footer = style.footer.format(summaries[0].pollid,
+                                     summaries[-1].pollid,
+                                     num_pages)
+
+        embed.set_footer(text=footer)
+
+        return embed
+
     @poll.command()
+    @commands.check(non_dm)
     async def list(self, ctx: commands.context, *args):
 
-        requests = self.messages.sql_requests
         style = self.messages.style.list
 
         if len(args) > 1:
             raise WrongArgLength("zero or one")
 
         if len(args) == 0:
-            page = 1
+            start = MAX_POLL_ID
         else:
             try:
-                page = int(args[0], base=10)
+                start = int(args[0], base=10)
             except ValueError:
-                raise ArgIsNaN("page")
+                raise ArgIsNaN("id")
 
-        if page < 1:
+        if start < 1:
             raise PageOOB()
+        # PollID is an int column; anything bigger means "from the newest"
+        start = min(start, MAX_POLL_ID)
 
-        cursor = self.conn.cursor()
-
-        num_pages = sql_request(
-            cursor, requests.num_pages, (POLLS_PER_PAGE,)
-        )[0]
+        num_pages = await self.get_num_pages(ctx.guild.id)
 
         if num_pages == 0:
             raise PollError("no_polls_to_list")
 
-        if page > num_pages:
+        summaries = await self.get_summaries(ctx.guild.id, older_than=start)
+
+        if not summaries:
             raise PageOOB()
 
-        poll_summaries = sql_request(cursor,
-                                     requests.summary,
-                                     (style.no_votes,
-                                      (page - 1) * POLLS_PER_PAGE,
-                                      POLLS_PER_PAGE))
+        message = await ctx.send(
+            embed=self.get_list_embed(summaries, num_pages))
 
-        format_string = style.summary_string
-        summaries = "\n".join(
-            format_string.format(str(i.pollid).zfill(3), i.question, i.result)
-            for i in poll_summaries
-        )
+        if num_pages < 2:
+            return
 
-        embed = discord.Embed(
-            color=random_color(),
-            title=style.title,
-            description=summaries
-        )
+        # let the invoker flip through pages with reactions
+        await message.add_reaction(style.previous)
+        await message.add_reaction(style.next)
 
-        footer = style.footer.format(page, int(num_pages))
+        def check(reaction, user):
+            return reaction.message.id == message.id and \
+                   user == ctx.author and \
+                   reaction.emoji in (style.previous, style.next)
 
-        embed.set_footer(text=footer)
+        while True:
+            try:
+                reaction, user = await self.bot.wait_for(
+                    'reaction_add', timeout=LIST_TIMEOUT, check=check)
+            except asyncio.TimeoutError:
+                break
 
-        await ctx.send(embed=embed)
+            await message.remove_reaction(reaction.emoji, user)
+
+            if reaction.emoji == style.next:
+                page = await self.get_summaries(
+                    ctx.guild.id, older_than=summaries[-1].pollid - 1)
+            else:
+                page = await self.get_summaries(
+                    ctx.guild.id, newer_than=summaries[0].pollid + 1)
+
+            # already on the first or last page
+            if not page:
+                continue
+
+            summaries = page
+            await message.edit(
+                embed=self.get_list_embed(summaries, num_pages))
+
+        await message.clear_reactions()
 
     ############################################################################
     # remove
@@ -385,34 +947,32 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
         except ValueError:
             raise ArgIsNaN("id")
 
-        cursor = self.conn.cursor()
-
-        poll_info = sql_request(cursor, requests.delete_poll_info,
-                                (poll_id,))
+        poll_info = await self.request_restoring(requests.delete_poll_info,
+                                                 (poll_id, ctx.guild.id),
+                                                 poll_id, ctx.guild.id)
 
         if not poll_info:
             raise PollError("poll_not_found")
 
         poll_info = poll_info[0]
 
-        if self.snowflake_to_str(ctx.author.id) != poll_info.username:
+        if ctx.author.id != poll_info.username:
             raise PollError("not_author")
 
         # delete old poll if it exists
-        channel = ctx.guild.get_channel(
-            self.str_to_snowflake(poll_info.channel)
-        )
+        channel = ctx.guild.get_channel(poll_info.channel)
         if channel:
             try:
-                message = await channel.fetch_message(
-                    self.str_to_snowflake(poll_info.message)
-                )
+                message = await channel.fetch_message(poll_info.message)
                 await message.delete()
             except discord.NotFound:
                 pass
 
-        cursor.execute(requests.delete_poll,
-                       (poll_id, poll_id, poll_id))
+        await self.conn.execute(requests.delete_poll,
+                                (poll_id, poll_id, poll_id))
+        self.poll_messages.discard(poll_info.message)
+        self.forget_tally(poll_id)
+        self.count_polls(ctx.guild.id, -1)
 
         await send(ctx, self.messages.style.delete.success.format(poll_id),
                    tag=True, expire=True)
@@ -435,24 +995,20 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
         except ValueError:
             raise ArgIsNaN("id")
 
-        cursor = self.conn.cursor()
-
-        poll_info = sql_request(cursor, requests.get_message_from_id,
-                                (datetime.utcnow(), poll_id))
+        poll_info = await self.request_restoring(
+            requests.get_message_from_id,
+            (datetime.utcnow(), poll_id, ctx.guild.id),
+            poll_id, ctx.guild.id)
 
         if not poll_info:
             raise PollError("poll_not_found")
         poll_info = poll_info[0]
 
         # delete old poll if it exists
-        channel = ctx.guild.get_channel(
-            self.str_to_snowflake(poll_info.channel)
-        )
+        channel = ctx.guild.get_channel(poll_info.channel)
         if channel:
             try:
-                message = await channel.fetch_message(
-                    self.str_to_snowflake(poll_info.message)
-                )
+                message = await channel.fetch_message(poll_info.message)
                 await message.delete()
             except discord.NotFound:
                 pass
@@ -461,24 +1017,25 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
         message = await send(ctx, self.messages.style.readout.loading,
                              tag=False, expire=False)
 
-        cursor.execute(requests.move_poll,
-                       (self.snowflake_to_str(message.id),
-                        self.snowflake_to_str(ctx.channel.id),
-                        poll_id))
+        await self.conn.execute(requests.move_poll,
+                                (message.id, ctx.channel.id, poll_id))
+        self.poll_messages.discard(poll_info.message)
+        self.poll_messages.add(message.id)
 
-        emojis = sql_request(cursor,
-                             requests.get_emojis,
-                             (poll_id,))
-        for emoji in emojis:
-            await message.add_reaction(self.str_to_emoji(emoji))
+        emojis = await self.conn.request(requests.get_emojis, (poll_id,))
 
-        await message.edit(content=self.get_poll_string(ctx.guild, poll_id))
+        self.seeding[poll_id] = [0, len(emojis)]
+        await message.edit(
+            content=await self.get_poll_string(ctx.guild, poll_id))
+
+        self.start_seeding(message, poll_id, emojis)
 
     ############################################################################
     # view
     ############################################################################
 
     @poll.command()
+    @commands.check(non_dm)
     async def view(self, ctx: commands.context, *args):
 
         requests = self.messages.sql_requests
@@ -492,32 +1049,28 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
         except ValueError:
             raise ArgIsNaN("id")
 
-        cursor = self.conn.cursor()
-
-        metadata = sql_request(cursor, requests.poll_metadata, (poll_id,))
+        metadata = await self.request_restoring(requests.poll_metadata,
+                                                (poll_id, ctx.guild.id),
+                                                poll_id, ctx.guild.id)
 
         if not metadata:
             raise PollError("poll_not_found")
         metadata = metadata[0]
 
-        channel = ctx.guild.get_channel(
-            self.str_to_snowflake(metadata.channel)
-        )
+        channel = ctx.guild.get_channel(metadata.channel)
 
         if not channel:
             link = None
         else:
             try:
-                message = await channel.fetch_message(
-                    self.str_to_snowflake(metadata.message)
-                )
+                message = await channel.fetch_message(metadata.message)
                 link = message.jump_url
             except discord.NotFound:
                 link = None
 
         title = style.overview_title.format(
             poll_id,
-            self.snowflake_to_user(ctx.guild, metadata.username))
+            (await self.get_names(ctx.guild, [metadata.username]))[0])
 
         if link:
             embed = discord.Embed(
@@ -546,7 +1099,7 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
 
         embed.add_field(
             name=style.option_title,
-            value=self.get_option_string(ctx.guild, poll_id),
+            value=await self.get_option_string(ctx.guild, poll_id),
             inline=False
         )
 
@@ -570,13 +1123,12 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
         except ValueError:
             raise ArgIsNaN("id")
 
-        cursor = self.conn.cursor()
-
         force = len(args) > 1
 
-        poll_info = sql_request(cursor,
-                                requests.get_message_from_id,
-                                (datetime.utcnow(), poll_id))
+        poll_info = await self.request_restoring(
+            requests.get_message_from_id,
+            (datetime.utcnow(), poll_id, ctx.guild.id),
+            poll_id, ctx.guild.id)
         if not poll_info:
             raise PollError("poll_not_found")
         poll_info = poll_info[0]
@@ -584,49 +1136,47 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
         # get old poll message if it exists
         message = None
 
-        channel = ctx.guild.get_channel(
-            self.str_to_snowflake(poll_info.channel)
-        )
+        channel = ctx.guild.get_channel(poll_info.channel)
         if channel:
             try:
-                message = await channel.fetch_message(
-                    self.str_to_snowflake(poll_info.message)
-                )
+                message = await channel.fetch_message(poll_info.message)
             except discord.NotFound:
                 pass
 
         if force:
-            emojis = sql_request(cursor,
-                                 requests.purge_force,
-                                 (poll_id, poll_id))
+            emojis = await self.conn.request(requests.purge_force,
+                                             (poll_id,))
         else:
-            emojis = sql_request(cursor,
-                                 requests.purge,
-                                 (poll_id, poll_id))
+            emojis = await self.conn.request(requests.purge, (poll_id,))
+        self.forget_tally(poll_id)
 
         # remove options from message
         if message:
+            remove = []
             for reaction in message.reactions:
 
-                remove = False
                 # custom emojis are not allowed on polls
                 if type(reaction.emoji) != str:
-                    remove = True
+                    remove.append(reaction)
 
                 # neither are multi-codepoint emojis (sorry, country flags)
-                if len(reaction.emoji) > 1:
-                    remove = True
+                elif len(reaction.emoji) > 1:
+                    remove.append(reaction)
 
                 elif self.emoji_to_str(reaction.emoji) in emojis:
-                    remove = True
+                    remove.append(reaction)
 
-                if remove:
-                    async for user in reaction.users():
-                        await reaction.remove(user)
+            # one call per emoji rather than one per user who reacted
+            bucket = self.get_reaction_bucket(message.channel)
 
-            await message.edit(
-                content=self.get_poll_string(ctx.guild, poll_id)
+            async def clear(reaction):
+                await bucket.wait()
+                await reaction.clear()
+
+            await asyncio.gather(*(clear(reaction) for reaction in remove))
 
+            await message.edit(
+                content=await self.get_poll_string(ctx.guild, poll_id)
             )
 
         await send(ctx, self.messages.style.purge.success.format(
@@ -634,6 +1184,7 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
         ), tag=True, expire=True)
 
     @poll.command()
+    @commands.check(non_dm)
     async def reset(self, ctx: commands.context, *args):
 
         style = self.messages.style.password
@@ -650,6 +1201,12 @@ class PollCog(commands.Cog, command_attrs=dict(no_pm=True)):
         except asyncio.TimeoutError:
             await send_dm(ctx.author, style.password_fail)
         else:
-            cursor = self.conn.cursor()
-            cursor.execute(self.messages.sql_requests.reset)
+            # only this guild's polls
+            deleted = await self.conn.request(
+                self.messages.sql_requests.reset,
+                (ctx.guild.id, ctx.guild.id))
+            for poll in deleted:
+                self.poll_messages.discard(poll.message)
+                self.forget_tally(poll.pollid)
+            self.poll_counts.pop(ctx.guild.id, None)
             await send_dm(ctx.author, style.password_succeed)
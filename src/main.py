@@ -1,4 +1,4 @@
-from discord.ext import commands
+from discord.ext import commands, tasks
 from src.cogs.help import HelpCog
 from src.cogs.poll import PollCog
 from src.cogs.error import ErrorCog
@@ -8,10 +8,14 @@ from src.cogs.color import ColorCog
 from src.cogs.parrot import ParrotCog
 from src.cogs.math import MathCog
 from src.base import *
+from src.migrate import upgrade_files
 import discord
 import psycopg2
 import os
 
+# minutes between dumps of the database pool and cog metrics to the log
+STATS_INTERVAL = 60
+
 def main():
   intents = discord.Intents.default()
   intents.members = True
@@ -23,8 +27,23 @@ def main():
     conn.set_session(readonly=False, autocommit=True)
     return conn
 
+  migration_conn = create_conn()
+  upgrade_files(migration_conn, ['data/poll.yaml', 'data/parrot.yaml'])
+  migration_conn.close()
+
   conn = Connection(create_conn)
 
+  @tasks.loop(minutes=STATS_INTERVAL)
+  async def log_stats():
+    print(f"database pool: {conn.stats()}")
+    for name, cog in bot.cogs.items():
+      if hasattr(cog, 'stats'):
+        print(f"{name}: {cog.stats()}")
+
+  @bot.listen()
+  async def on_ready():
+    if not log_stats.is_running():
+      log_stats.start()
 
   bot.add_cog(HelpCog('data/help.yaml', bot=bot))
   bot.add_cog(PollCog('data/poll.yaml', conn=conn, bot=bot))
@@ -0,0 +1,133 @@
+"""
+Versioned schema migrations.
+
+Each cog that owns tables lists its migrations in its yaml file under
+`migrations`, oldest first. upgrade() applies the ones a database has not
+seen yet, each in its own transaction, and records the version reached in
+the SchemaVersions table, so existing data is upgraded in place instead of
+being wiped with `reset`.
+
+Running this module prints the query plans of the queries listed under
+`explain` in the given files, which is handy for comparing plans before and
+after a migration:
+
+    python -m src.migrate data/poll.yaml data/parrot.yaml
+    python -m src.migrate --upgrade data/poll.yaml data/parrot.yaml
+"""
+
+import os
+import sys
+import psycopg2
+from ruamel.yaml import YAML
+
+CREATE_VERSIONS = """
+CREATE TABLE IF NOT EXISTS SchemaVersions (
+Component varchar(32) PRIMARY KEY,
+Version   int NOT NULL);
+"""
+
+# serializes concurrent upgrades of the same database
+LOCK = "SELECT pg_advisory_xact_lock(hashtext('SchemaVersions'));"
+
+GET_VERSION = "SELECT Version FROM SchemaVersions WHERE Component=%s;"
+
+SET_VERSION = """
+INSERT INTO SchemaVersions (Component, Version) VALUES (%s, %s)
+ON CONFLICT (Component) DO UPDATE SET Version=EXCLUDED.Version;
+"""
+
+
+def upgrade(cursor, component: str, migrations):
+    """
+    Brings a component's tables up to date. Expects an autocommit
+    connection; each migration gets its own transaction.
+    :param cursor: a cursor on the database to upgrade.
+    :param component: the name the versions are recorded under.
+    :param migrations: a list of dicts with a version, a description and
+    the sql to run, in ascending version order.
+    :return: the list of versions that were applied.
+    """
+    cursor.execute(CREATE_VERSIONS)
+
+    applied = []
+    for migration in migrations:
+        cursor.execute("BEGIN;")
+        try:
+            cursor.execute(LOCK)
+            cursor.execute(GET_VERSION, (component,))
+            row = cursor.fetchone()
+            version = row[0] if row else 0
+
+            if migration['version'] <= version:
+                cursor.execute("COMMIT;")
+                continue
+
+            print(f"migrate: {component} {migration['version']}: "
+                  f"{migration['description']}")
+            cursor.execute(migration['sql'])
+            cursor.execute(SET_VERSION, (component, migration['version']))
+            cursor.execute("COMMIT;")
+        except Exception:
+            cursor.execute("ROLLBACK;")
+            raise
+
+        applied.append(migration['version'])
+
+    return applied
+
+
+def explain(cursor, requests, samples):
+    """
+    Gets the query plans of a set of queries.
+    :param cursor: a cursor on the database to ask.
+    :param requests: the sql_requests of a cog.
+    :param samples: a dict mapping request names to sample arguments.
+    :return: a dict mapping request names to their plans.
+    """
+    plans = {}
+    for name, args in samples.items():
+        cursor.execute("EXPLAIN " + requests[name], args)
+        plans[name] = "\n".join(row[0] for row in cursor.fetchall())
+    return plans
+
+
+def load(path: str):
+    yaml = YAML(typ='safe')
+    with open(path, 'r') as fd:
+        return yaml.load(fd)
+
+
+def upgrade_files(conn, paths):
+    """
+    Upgrades the tables of every cog yaml file given.
+    :param conn: an autocommit psycopg2 connection.
+    :param paths: the yaml files to read migrations from.
+    """
+    cursor = conn.cursor()
+    for path in paths:
+        data = load(path)
+        upgrade(cursor, data['component'], data['migrations'])
+    cursor.close()
+
+
+def main(argv):
+    paths = [arg for arg in argv if arg != "--upgrade"]
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], sslmode='require')
+    conn.set_session(readonly=False, autocommit=True)
+
+    if "--upgrade" in argv:
+        upgrade_files(conn, paths)
+
+    cursor = conn.cursor()
+    for path in paths:
+        data = load(path)
+        plans = explain(cursor, data['sql_requests'], data.get('explain', {}))
+        for name, plan in plans.items():
+            print(f"== {path}: {name}\n{plan}\n")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
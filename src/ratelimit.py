@@ -0,0 +1,46 @@
+"""
+Client-side rate limiting, so the bot stays under Discord's limits instead of
+running into them.
+TokenBucket - a token bucket that can be polled or awaited.
+"""
+
+import asyncio
+import time
+
+
+class TokenBucket(object):
+    """
+    Refills at `rate` tokens per second, holding at most `capacity` tokens.
+    A full bucket allows a burst of `capacity` actions; after that, actions
+    are spaced out to `rate` per second.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def consume(self, tokens: float = 1):
+        """
+        Takes tokens from the bucket if there are enough of them.
+        :return: True if the tokens were taken.
+        """
+        self.refill()
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+    async def wait(self, tokens: float = 1):
+        """
+        Sleeps until enough tokens are available, then takes them.
+        """
+        while not self.consume(tokens):
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
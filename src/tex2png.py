@@ -1,7 +1,131 @@
+import asyncio
 import os
+import shutil
+import subprocess
+import tempfile
 
+# renders happen in memory when there is a tmpfs to do them in
+MEMORY_DIR = "/dev/shm"
+WORKDIR_PREFIX = "tex2png-"
 
-def tex2png(snippet: str, **kwargs):
+# seconds a latex or dvipng run may take before it is killed;
+# nonstopmode does not stop a snippet that loops forever
+RENDER_TIMEOUT = 10
+# building a format reads every package, so it gets longer
+FORMAT_TIMEOUT = 60
+
+# the part of every document that is the same from render to render, given
+# the font sizes. it is compiled into a format once, see get_format().
+PREAMBLE = r"""\documentclass[fleqn]{{article}}
+\DeclareMathSizes{{{0}}}{{{1}}}{{{0}}}{{{0}}}
+\usepackage{{amssymb,amsmath,bm}}
+\usepackage[latin1]{{inputenc}}
+"""
+
+BODY = r"""\begin{{document}}
+\thispagestyle{{empty}}
+\begin{{equation*}}
+{0}
+\end{{equation*}}
+\end{{document}}"""
+
+# (latex, format directory, fontsize, mathsize) -> format name, or None if
+# the format could not be built
+formats = {}
+format_locks = {}
+
+
+class RenderBusy(Exception):
+    pass
+
+
+def default_tempdir():
+    if os.path.isdir(MEMORY_DIR) and os.access(MEMORY_DIR, os.W_OK):
+        return MEMORY_DIR
+    return None
+
+
+def default_formatdir():
+    return os.path.join(default_tempdir() or tempfile.gettempdir(),
+                        "latex-formats")
+
+
+async def run(args, debug: bool, cwd: str, env=None,
+              timeout: float = None):
+    """
+    Runs a command without a shell and waits for it, killing it if the
+    wait is cancelled or takes longer than timeout.
+    :param args: the program and its arguments.
+    :param debug: if False, the output is discarded.
+    :param cwd: the directory to run it in.
+    :param env: the environment to run it with, if not this process's.
+    :param timeout: the seconds to wait before killing it, RENDER_TIMEOUT
+    if None.
+    :return: the exit status.
+    :raises asyncio.TimeoutError: if it was killed for taking too long.
+    """
+    output = None if debug else subprocess.DEVNULL
+    process = await asyncio.create_subprocess_exec(
+        *args, stdin=subprocess.DEVNULL, stdout=output, stderr=output,
+        cwd=cwd, env=env)
+    try:
+        return await asyncio.wait_for(process.wait(),
+                                      timeout or RENDER_TIMEOUT)
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            # reap it, so that it is not left a zombie and is done with cwd
+            # before anything removes it
+            await process.wait()
+        raise
+
+
+async def get_format(latex: str, formatdir: str, fontsize, mathsize,
+                     debug: bool = False):
+    """
+    Builds the preamble for a pair of font sizes into a LaTeX format with
+    `latex -ini ... \\dump`, the first time it is asked for. Documents
+    compiled with the format start at \\begin{document}, skipping the
+    package loading that takes up most of a render.
+    :param latex: the latex binary.
+    :param formatdir: the directory to keep formats in.
+    :return: the name of the format, to be found through TEXFORMATS, or None
+    if it could not be built.
+    """
+    key = (latex, formatdir, fontsize, mathsize)
+    if key in formats:
+        return formats[key]
+
+    lock = format_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        if key in formats:
+            return formats[key]
+
+        name = f"tex2png-{fontsize}-{mathsize}"
+        os.makedirs(formatdir, exist_ok=True)
+        with open(os.path.join(formatdir, name + ".tex"), "w") as texfile:
+            texfile.write(PREAMBLE.format(fontsize, mathsize))
+
+        # start from the plain latex format, read the preamble, dump
+        base = "&" + os.path.basename(latex)
+        try:
+            status = await run([latex, "-ini", "-interaction=nonstopmode",
+                                f"-jobname={name}", base, name + ".tex",
+                                "\\dump"], debug, formatdir,
+                               timeout=FORMAT_TIMEOUT)
+        except (FileNotFoundError, asyncio.TimeoutError):
+            status = None
+
+        if status != 0:
+            print(f"tex2png: the {name} format could not be built; "
+                  f"rendering without it.")
+            name = None
+
+        formats[key] = name
+        return name
+
+
+async def tex2png(snippet: str, **kwargs):
     """
     Author: Eric Schneider
     Adapted from Ivan E. Cao-Berg's MATLAB script, found here:
@@ -10,7 +134,9 @@ def tex2png(snippet: str, **kwargs):
     Feel free to use this wherever <3
 
     tex2png
-    A python script to convert LaTeX snippets to images.
+    A python coroutine to convert LaTeX snippets to images. latex and dvipng
+    run as subprocesses, so the event loop keeps going while they work, in a
+    temporary directory of their own that is removed afterwards.
     Dependencies:
     - some sort of TeX typesetter. I recommend texlive.
     - dvipng
@@ -19,87 +145,179 @@ def tex2png(snippet: str, **kwargs):
         snippet: the LaTeX snippet to parse.
 
     kwargs:
-        debug: If enabled, will keep intermediate files and print command output
-            to stdout.
+        debug: If enabled, will keep the working directory and print command
+            output to stdout.
         density: Proportional to the size of the output image.
         background: The background color. Translates to the -bg parameter of
             dvipng, so read its manual for formatting info.
         foreground: The foreground color. Translates to -fg of dvipng.
-        outfile: The pathname (without the .png) of the output file.
+        tempdir: Where to make the working directory. Defaults to /dev/shm
+            if it exists, so that nothing touches the disk.
+        formatdir: Where to keep the precompiled preambles. None to read the
+            preamble from scratch every time. A format that fails to compile
+            a snippet the full preamble compiles is not used again.
         fontsize, mathsize: I'm...not really sure.
 
     returns:
+        (status, png), where png is the image as bytes (None on failure) and
+        status is
         -1 for user error
         0 for success
         1 for programmer error
     """
-    tex_format = r"""\documentclass[fleqn]{{article}}
-    \DeclareMathSizes{{{0}}}{{{1}}}{{{0}}}{{{0}}}
-    \usepackage{{amssymb,amsmath,bm}}
-    \usepackage[latin1]{{inputenc}}
-    \begin{{document}}
-    \thispagestyle{{empty}}
-    \begin{{equation*}}
-    {2}
-    \end{{equation*}}
-    \end{{document}}"""
-
     debug = kwargs.get('debug', False)
     density = kwargs.get('density', 500)
     background = kwargs.get('background', "rgb 1.0 1.0 1.0")
     foreground = kwargs.get('foreground', "rgb 0.0 0.0 0.0")
-    outfile = kwargs.get('outfile', 'snippet')
+    tempdir = kwargs.get('tempdir', default_tempdir())
+    formatdir = kwargs.get('formatdir', default_formatdir())
     fontsize = kwargs.get('fontsize', 20)
     mathsize = kwargs.get('mathsize', 30)
     latex = kwargs.get('latex', '/usr/bin/latex')
     dvipng = kwargs.get('dvipng', '/usr/bin/dvipng')
     checks = kwargs.get('checks', True)
 
-    # delete intermediate files
-    def cleanup():
-        if not debug:
-            extensions = [".aux", ".dvi", ".log", ".tex"]
-            for extension in extensions:
-                try:
-                    os.remove(outfile + extension)
-                except FileNotFoundError:
-                    pass
-
-    # send output to black hole if not in debug mode.
-    pipe = "" if debug else " > /dev/null"
-
     if checks:
         # check for binaries
         if not os.path.isfile(latex):
             print(f"tex2png: LaTeX was not found in '{latex}'. To install "
                   f"LaTex in Ubuntu type in terminal: sudo apt-get install "
                   f"texlive-full")
-            return 1
+            return 1, None
 
         if not os.path.isfile(dvipng):
             print(f"tex2png: dvipng was not found in '{dvipng}'. To install "
                   f"dvipng in Ubuntu type in terminal: sudo apt-get install "
                   f"dvipng")
-            return 1
+            return 1, None
+
+    fmt = None
+    if formatdir:
+        fmt = await get_format(latex, formatdir, fontsize, mathsize, debug)
+
+    # (tex, latex options, environment) to compile with, in order. with a
+    # format, the full preamble is the fallback: if it compiles where the
+    # format did not, the format is what is broken, not the snippet.
+    compiles = [(PREAMBLE.format(fontsize, mathsize) + BODY.format(snippet),
+                 [], None)]
+    if fmt:
+        # a trailing separator keeps the default format path searched too
+        compiles.insert(0, (BODY.format(snippet), [f"-fmt={fmt}"],
+                            dict(os.environ,
+                                 TEXFORMATS=formatdir + os.pathsep)))
+
+    async def to_dvi(workdir):
+        """
+        Compiles the snippet to dvi, with the format if there is one.
+        :return: whether it compiled.
+        """
+        for attempt, (tex, options, env) in enumerate(compiles):
+            with open(os.path.join(workdir, "snippet.tex"), "w") as texfile:
+                texfile.write(tex)
+
+            if await run([latex, *options, "-interaction=nonstopmode",
+                          "snippet.tex"], debug, workdir, env) == 0:
+                if attempt > 0:
+                    print(f"tex2png: the {fmt} format does not compile; "
+                          f"rendering without it.")
+                    formats[(latex, formatdir, fontsize, mathsize)] = None
+                return True
+        return False
+
+    async def render(workdir):
+        try:
+            # format tex to dvi
+            if not await to_dvi(workdir):
+                print(f"tex2png: LaTeX command returned a non-zero value.")
+                return -1, None
+
+            # format dvi to png
+            if await run([dvipng, "-q", "-T", "tight",
+                          "-bg", background, "-fg", foreground,
+                          "-D", str(density), "snippet.dvi",
+                          "-o", "snippet.png"], debug, workdir) != 0:
+                print(f"tex2png: dvipng returned a non-zero value.")
+                return -1, None
+        except asyncio.TimeoutError:
+            print(f"tex2png: rendering took longer than {RENDER_TIMEOUT} "
+                  f"seconds and was stopped.")
+            return -1, None
+        except FileNotFoundError as error:
+            print(f"tex2png: '{error.filename}' could not be run.")
+            return 1, None
+
+        with open(os.path.join(workdir, "snippet.png"), "rb") as png:
+            return 0, png.read()
+
+    if debug:
+        workdir = tempfile.mkdtemp(prefix=WORKDIR_PREFIX, dir=tempdir)
+        print(f"tex2png: working in '{workdir}'")
+        return await render(workdir)
+
+    # removed on the way out, whether the render worked, failed or raised
+    with tempfile.TemporaryDirectory(prefix=WORKDIR_PREFIX,
+                                     dir=tempdir) as workdir:
+        return await render(workdir)
+
+
+def remove_workdirs(tempdir: str = None):
+    """
+    Removes working directories left behind by a process that died in the
+    middle of a render.
+    """
+    tempdir = tempdir or default_tempdir() or tempfile.gettempdir()
+    for entry in os.scandir(tempdir):
+        if entry.name.startswith(WORKDIR_PREFIX) and entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+class Renderer(object):
+    """
+    Runs tex2png with at most max_running renders at once and at most
+    max_queued more waiting their turn. Past that, render() raises
+    RenderBusy instead of letting the backlog grow.
+    """
+
+    def __init__(self, max_running: int, max_queued: int, **kwargs):
+        """
+        :param kwargs: default keyword arguments for tex2png.
+        """
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.kwargs = kwargs
 
-    # write tex file
-    with open(f"{outfile}.tex", "w") as texfile:
-        texfile.write(tex_format.format(fontsize, mathsize, snippet))
+        self.slots = asyncio.Semaphore(max_running)
+        # renders running or waiting
+        self.pending = 0
 
-    # format tex to dvi
-    if os.system(f"{latex} -interaction=nonstopmode {outfile}.tex{pipe}") != 0:
-        print(f"tex2png: LaTeX command returned a non-zero value.")
-        cleanup()
-        return -1
+        remove_workdirs(kwargs.get('tempdir'))
 
-    # format dvi to png
-    if os.system(f"{dvipng} -q -T tight -bg '{background}' -fg '{foreground}' "
-              f"-D {density} {outfile}.dvi -o {outfile}.png{pipe}") != 0:
-        print(f"tex2png: dvipng returned a non-zero value.")
-        cleanup()
-        return -1
+    async def prepare(self):
+        """
+        Builds the preamble format for the default font sizes ahead of the
+        first render.
+        """
+        kwargs = self.kwargs
+        formatdir = kwargs.get('formatdir', default_formatdir())
+        if formatdir:
+            await get_format(kwargs.get('latex', '/usr/bin/latex'), formatdir,
+                             kwargs.get('fontsize', 20),
+                             kwargs.get('mathsize', 30),
+                             kwargs.get('debug', False))
 
+    async def render(self, snippet: str, **kwargs):
+        """
+        Renders a snippet once a slot is free.
+        :param kwargs: keyword arguments for tex2png, over the defaults.
+        :return: whatever tex2png returns.
+        """
+        if self.pending >= self.max_running + self.max_queued:
+            raise RenderBusy()
 
-    cleanup()
-    return 0
+        self.pending += 1
+        try:
+            async with self.slots:
+                return await tex2png(snippet, **dict(self.kwargs, **kwargs))
+        finally:
+            self.pending -= 1
 
@@ -0,0 +1,182 @@
+"""
+In-memory indexes over parrot triggers.
+TriggerAutomaton - finds every trigger inside a message in one pass.
+TriggerIndex - resolves trigger names and prefixes for parrot commands.
+"""
+
+import bisect
+
+
+class TriggerAutomaton(object):
+    """
+    An Aho-Corasick automaton over a set of triggers, each belonging to a
+    parrot. search() walks a message once, whatever the number of triggers,
+    and returns the IDs of every parrot with a trigger somewhere in it.
+
+    Adding a trigger extends the trie in place; the failure links are redone
+    lazily on the next search. Removing a trigger rebuilds the trie, also
+    lazily, since removals only happen on (rare) delete commands.
+    """
+
+    def __init__(self, triggers=()):
+        # trigger -> parrot id
+        self.patterns = {}
+
+        self.goto = [{}]
+        self.fail = [0]
+        # parrot ids of the triggers ending exactly at each node
+        self.ends = [set()]
+        # parrot ids of every trigger matched on reaching each node
+        self.out = [set()]
+
+        self.stale = False
+        self.dirty = False
+
+        for trigger, parrot_id in triggers:
+            self.add(trigger, parrot_id)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def insert(self, trigger: str, parrot_id: int):
+        node = 0
+        for char in trigger:
+            child = self.goto[node].get(char)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][char] = child
+                self.goto.append({})
+                self.fail.append(0)
+                self.ends.append(set())
+                self.out.append(set())
+            node = child
+        self.ends[node].add(parrot_id)
+
+    def add(self, trigger: str, parrot_id: int):
+        # a trigger that moves to another parrot has to leave the old one
+        if self.patterns.get(trigger, parrot_id) != parrot_id:
+            self.dirty = True
+        self.patterns[trigger] = parrot_id
+        self.insert(trigger, parrot_id)
+        self.stale = True
+
+    def remove(self, trigger: str):
+        if self.patterns.pop(trigger, None) is not None:
+            self.dirty = True
+
+    def remove_parrot(self, parrot_id: int):
+        for trigger in [trigger for trigger, i in self.patterns.items()
+                        if i == parrot_id]:
+            self.remove(trigger)
+
+    def clear(self):
+        self.__init__()
+
+    def build(self):
+        """
+        Recomputes the failure links and outputs, rebuilding the trie first
+        if any trigger was removed.
+        """
+        if self.dirty:
+            patterns = self.patterns
+            self.__init__(patterns.items())
+
+        queue = []
+        for child in self.goto[0].values():
+            self.fail[child] = 0
+            queue.append(child)
+        self.out[0] = set(self.ends[0])
+
+        # breadth first, so every node's failure target is already done
+        for node in queue:
+            self.out[node] = self.ends[node] | self.out[self.fail[node]]
+            for char, child in self.goto[node].items():
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                queue.append(child)
+
+        self.stale = False
+
+    def search(self, text: str):
+        """
+        :param text: the (lowercased) message to search.
+        :return: the set of parrot IDs with a trigger in text.
+        """
+        if self.stale or self.dirty:
+            self.build()
+
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found |= out[node]
+
+        return found
+
+
+class TriggerIndex(object):
+    """
+    Every trigger and alias in sorted order, so that the triggers starting
+    with a prefix sit next to each other and are found with a binary search.
+    """
+
+    def __init__(self):
+        self.keys = []
+        # trigger -> (parrot id, whether it is an alias)
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, trigger: str):
+        return trigger in self.entries
+
+    def get(self, trigger: str):
+        """
+        :return: (parrot id, alias) for an exact trigger, or None.
+        """
+        return self.entries.get(trigger)
+
+    def add(self, trigger: str, parrot_id: int, alias: bool):
+        if trigger not in self.entries:
+            bisect.insort(self.keys, trigger)
+        self.entries[trigger] = (parrot_id, alias)
+
+    def remove(self, trigger: str):
+        if self.entries.pop(trigger, None) is None:
+            return
+        del self.keys[bisect.bisect_left(self.keys, trigger)]
+
+    def remove_parrot(self, parrot_id: int):
+        for trigger in [trigger for trigger, (i, _) in self.entries.items()
+                        if i == parrot_id]:
+            self.remove(trigger)
+
+    def clear(self):
+        self.__init__()
+
+    def completions(self, prefix: str = ""):
+        """
+        :return: the sorted list of triggers starting with prefix.
+        """
+        start = bisect.bisect_left(self.keys, prefix)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(prefix):
+            end += 1
+        return self.keys[start:end]
+
+    def parrots(self, prefix: str):
+        """
+        :return: the set of parrot IDs with a trigger starting with prefix.
+        """
+        return {self.entries[trigger][0]
+                for trigger in self.completions(prefix)}
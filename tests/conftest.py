@@ -0,0 +1,17 @@
+"""
+Helpers shared by the tests.
+"""
+
+import asyncio
+
+
+def run(coroutine):
+    """
+    Runs a coroutine to completion on a fresh event loop, so that no test
+    sees another's tasks.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
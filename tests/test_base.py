@@ -0,0 +1,159 @@
+"""
+Tests for the database pool in src/base.py, using stand-in connections that
+sleep instead of talking to postgres.
+"""
+
+import asyncio
+import time
+
+import psycopg2
+
+from src import base
+from src.base import Connection
+
+from conftest import run
+
+QUERY_TIME = 0.2
+TICK = 0.01
+
+
+class SlowCursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = None
+
+    def execute(self, call, args=None):
+        self.conn.calls.append(call)
+        if self.conn.fail_next:
+            self.conn.fail_next = False
+            self.conn.closed = 1
+            raise psycopg2.OperationalError("server closed the connection")
+        time.sleep(QUERY_TIME)
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class SlowConnection(object):
+    def __init__(self):
+        self.closed = 0
+        self.calls = []
+        self.fail_next = False
+
+    def cursor(self):
+        return SlowCursor(self)
+
+    def close(self):
+        self.closed = 1
+
+
+async def max_lag_during(coroutine):
+    """
+    Runs coroutine while a ticker measures how late the event loop wakes it.
+    :return: the longest delay past a tick, in seconds.
+    """
+    done = False
+    lag = 0.0
+
+    async def ticker():
+        nonlocal lag
+        while not done:
+            start = time.monotonic()
+            await asyncio.sleep(TICK)
+            lag = max(lag, time.monotonic() - start - TICK)
+
+    task = asyncio.ensure_future(ticker())
+    try:
+        await coroutine
+    finally:
+        done = True
+        await task
+    return lag
+
+
+def test_slow_queries_do_not_block_the_loop():
+
+    async def main():
+        conn = Connection(SlowConnection, min_size=1, max_size=4)
+        queries = asyncio.gather(*(conn.execute("SELECT pg_sleep(1)")
+                                   for _ in range(8)))
+        return conn, await max_lag_during(queries)
+
+    conn, lag = run(main())
+
+    # 8 queries of QUERY_TIME on 4 connections took 2 rounds, and the loop
+    # kept ticking the whole time
+    assert lag < QUERY_TIME / 2
+    assert conn.size <= 4
+    assert conn.leases == 8
+
+
+def test_uncontended_lease_does_not_wait():
+
+    async def main():
+        conn = Connection(SlowConnection, min_size=1, max_size=4)
+        await conn.execute("SELECT 1")
+        return conn.stats()
+
+    stats = run(main())
+    assert stats["leases"] == 1
+    assert stats["waits"] == 0
+
+
+def test_contended_leases_wait():
+
+    async def main():
+        conn = Connection(SlowConnection, min_size=1, max_size=4)
+        await asyncio.gather(*(conn.execute("SELECT 1") for _ in range(10)))
+        return conn.stats()
+
+    stats = run(main())
+    assert stats["leases"] == 10
+    assert stats["waits"] == 6
+
+
+def test_statement_is_not_retried_after_being_sent():
+    connections = []
+
+    def connect():
+        conn = SlowConnection()
+        connections.append(conn)
+        return conn
+
+    async def main():
+        conn = Connection(connect, min_size=1, max_size=1)
+        connections[0].fail_next = True
+        try:
+            await conn.execute("INSERT INTO Polls DEFAULT VALUES")
+        except psycopg2.OperationalError:
+            pass
+        else:
+            raise AssertionError("the failed insert was retried")
+
+    run(main())
+    assert sum(len(conn.calls) for conn in connections) == 1
+
+
+def test_dead_idle_connection_is_replaced(monkeypatch):
+    connections = []
+
+    def connect():
+        conn = SlowConnection()
+        connections.append(conn)
+        return conn
+
+    # check every pooled connection before use, and retry straight away
+    monkeypatch.setattr(base, "DATABASE_IDLE_CHECK", -1)
+    monkeypatch.setattr(base, "DATABASE_BACKOFF", 0)
+
+    async def main():
+        conn = Connection(connect, min_size=1, max_size=1)
+        connections[0].fail_next = True
+        await conn.execute("INSERT INTO Polls DEFAULT VALUES")
+
+    run(main())
+    assert [conn.calls for conn in connections] == \
+        [["SELECT 1"], ["INSERT INTO Polls DEFAULT VALUES"]]
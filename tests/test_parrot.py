@@ -0,0 +1,86 @@
+"""
+Tests for the message filter in src/cogs/parrot.py, without a live bot.
+"""
+
+import discord
+
+from src.base import Statements
+from src.cogs.parrot import ParrotCog
+
+from conftest import run
+
+
+class Channel(object):
+    type = discord.ChannelType.text
+
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+
+class Guild(object):
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+
+class Message(object):
+    def __init__(self, guild_id, channel_id, content):
+        self.guild = Guild(guild_id)
+        self.channel = Channel(channel_id)
+        self.author = "someone"
+        self.content = content
+
+
+class Bot(object):
+    user = "parrot bot"
+    command_prefix = "!"
+
+    def __init__(self):
+        self.contexts = 0
+
+    async def get_context(self, message):
+        self.contexts += 1
+        raise AssertionError("built a context for " + message.content)
+
+
+class SwitchConnection(object):
+    """
+    Stands in for the database, remembering which guilds and channels are
+    disabled.
+    """
+
+    def __init__(self, guilds, channels):
+        self.statements = Statements()
+        self.guilds = list(guilds)
+        self.channels = list(channels)
+
+    async def request(self, call, args=None):
+        if "DisabledGuilds" in call:
+            return self.guilds
+        return self.channels
+
+
+def test_disabled_channel_is_filtered_before_commands():
+    bot = Bot()
+    cog = ParrotCog('data/parrot.yaml', conn=SwitchConnection([], [2]),
+                    bot=bot)
+
+    async def main():
+        await cog.load_disabled()
+        return [await cog.filter_message(Message(1, 2, "!parrot list")),
+                await cog.filter_message(Message(1, 1, "hello world"))]
+
+    assert run(main()) == ["channel_disabled", None]
+    assert bot.contexts == 0
+
+
+def test_disabled_guild_does_not_silence_others():
+    bot = Bot()
+    cog = ParrotCog('data/parrot.yaml', conn=SwitchConnection([1], []),
+                    bot=bot)
+
+    async def main():
+        await cog.load_disabled()
+        return [await cog.filter_message(Message(1, 1, "hello world")),
+                await cog.filter_message(Message(2, 3, "hello world"))]
+
+    assert run(main()) == ["disabled", None]
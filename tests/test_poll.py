@@ -0,0 +1,258 @@
+"""
+Tests for the helpers in src/cogs/poll.py that don't need a live bot.
+"""
+
+import asyncio
+from collections import namedtuple
+
+import discord
+import psycopg2
+
+from src.base import Statements
+from src.cogs.poll import EditScheduler, NameCache, PollCog
+
+from conftest import run
+
+
+class Message(object):
+    def __init__(self):
+        self.edits = []
+
+    async def edit(self, content):
+        self.edits.append(content)
+
+
+def test_failed_render_does_not_drop_later_changes():
+
+    async def main():
+        edits = EditScheduler(window=0.01)
+        message = Message()
+
+        async def render():
+            return "final"
+
+        async def broken():
+            # a vote comes in while this render is in flight
+            edits.schedule(1, message, render)
+            raise AttributeError("poll went away")
+
+        edits.schedule(1, message, broken)
+        while edits.tasks:
+            await asyncio.sleep(0.01)
+        return message.edits
+
+    assert run(main()) == ["final"]
+
+
+class TallyLease(object):
+    """
+    Stands in for a database lease, answering get_tally's two queries
+    after a delay.
+    """
+    Poll = namedtuple('sql_return', ('question', 'username'))
+    Option = namedtuple('sql_return',
+                        ('optionid', 'emoji', 'option', 'votes'))
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def request(self, call, args=None):
+        await asyncio.sleep(0.01)
+        if call == self.conn.requests.get_poll:
+            self.conn.loads += 1
+            return [self.Poll("question?", 1)]
+        return [self.Option(1, "0001F44D", "yes", [])]
+
+
+class TallyConnection(object):
+    def __init__(self):
+        self.statements = Statements()
+        self.requests = None
+        self.loads = 0
+
+    def lease(self):
+        return TallyLease(self)
+
+
+def make_cog(conn):
+    cog = PollCog('data/poll.yaml', conn=conn, bot=None)
+    cog.archive.cancel()
+    conn.requests = cog.messages.sql_requests
+    return cog
+
+
+def test_concurrent_misses_share_one_tally():
+
+    async def main():
+        conn = TallyConnection()
+        cog = make_cog(conn)
+
+        tallies = await asyncio.gather(*(cog.get_tally(7) for _ in range(5)))
+        for user, tally in enumerate(tallies):
+            tally.vote(1, user, True)
+
+        return conn.loads, tallies, await cog.get_tally(7)
+
+    loads, tallies, cached = run(main())
+    assert loads == 1
+    assert all(tally is cached for tally in tallies)
+    assert cached.options[1].voters == [0, 1, 2, 3, 4]
+
+
+def test_forgotten_load_is_not_cached():
+
+    async def main():
+        conn = TallyConnection()
+        cog = make_cog(conn)
+
+        loading = asyncio.ensure_future(cog.get_tally(7))
+        await asyncio.sleep(0)
+        # an option is appended while the tally is loading
+        cog.forget_tally(7)
+        await loading
+
+        return 7 in cog.tallies
+
+    assert not run(main())
+
+
+class ArchiveConnection(object):
+    """
+    Stands in for the database, holding one poll that starts out archived.
+    """
+
+    def __init__(self, message):
+        self.statements = Statements()
+        self.requests = None
+        self.message = message
+        self.archived = True
+
+    async def request(self, call, args=None):
+        if call == self.requests.restore_poll:
+            restored, self.archived = self.archived, False
+            return [self.message] if restored else []
+        if call == self.requests.archive_polls:
+            raise psycopg2.OperationalError("server closed the connection")
+        return [] if self.archived else [("poll info",)]
+
+
+def test_archived_poll_is_restored_for_commands():
+
+    async def main():
+        conn = ArchiveConnection(message=30)
+        cog = make_cog(conn)
+        cog.archived_messages[30] = 5
+
+        info = await cog.request_restoring(conn.requests.delete_poll_info,
+                                           (5, 1), 5, 1)
+        return info, cog
+
+    info, cog = run(main())
+    assert info == [("poll info",)]
+    assert 30 in cog.poll_messages
+    assert 30 not in cog.archived_messages
+
+
+def test_archive_survives_database_errors():
+
+    async def main():
+        cog = make_cog(ArchiveConnection(message=30))
+        # the body of one run of the loop
+        await cog.archive.coro(cog)
+
+    run(main())
+
+
+class Response(object):
+    def __init__(self, status):
+        self.status = status
+        self.reason = "test"
+
+
+class Guild(object):
+    id = 1
+
+    def get_member(self, user_id):
+        return None
+
+
+class FlakyBot(object):
+    """
+    Stands in for the bot, failing one user lookup with a server error.
+    """
+
+    def __init__(self):
+        self.fetches = []
+
+    def get_user(self, user_id):
+        return None
+
+    async def fetch_user(self, user_id):
+        self.fetches.append(user_id)
+        if user_id == 2:
+            raise discord.HTTPException(Response(503), "unavailable")
+        if user_id == 3:
+            raise discord.NotFound(Response(404), "unknown user")
+        return namedtuple('User', 'name')(f"user {user_id}")
+
+
+def test_failed_name_lookup_does_not_fail_the_others():
+    bot = FlakyBot()
+    names = NameCache(bot)
+
+    first = run(names.get(Guild(), [1, 2, 3]))
+    assert first == {1: "user 1", 3: None}
+
+    # the failed lookup is tried again, the others are cached
+    run(names.get(Guild(), [1, 2, 3]))
+    assert bot.fetches.count(2) == 2
+    assert bot.fetches.count(1) == 1
+
+
+class Channel(object):
+    id = 1
+
+
+class ReactionLimitedMessage(Message):
+    """
+    A poll message that refuses reactions past the first, as discord does
+    without the Add Reactions permission or at the reaction limit.
+    """
+    channel = Channel()
+    guild = Guild()
+
+    def __init__(self):
+        super().__init__()
+        self.reactions = []
+
+    async def add_reaction(self, emoji):
+        if self.reactions:
+            raise discord.Forbidden(Response(403), "missing permissions")
+        self.reactions.append(emoji)
+
+
+def test_refused_reaction_still_finishes_seeding():
+
+    async def main():
+        cog = make_cog(TallyConnection())
+        cog.edits = EditScheduler(window=0.01)
+        message = ReactionLimitedMessage()
+
+        async def get_poll_string(guild, poll_id):
+            return "seeding" if poll_id in cog.seeding else "done"
+        cog.get_poll_string = get_poll_string
+
+        cog.start_seeding(message, 7, ["0001F44D", "0001F44E", "0001F937"])
+        while cog.seeders or cog.edits.tasks:
+            await asyncio.sleep(0.01)
+        return message
+
+    message = run(main())
+    assert len(message.reactions) == 1
+    assert message.edits[-1] == "done"
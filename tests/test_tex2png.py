@@ -0,0 +1,87 @@
+"""
+Tests for src/tex2png.py, with shell scripts standing in for latex and
+dvipng.
+"""
+
+import os
+import stat
+
+from src import tex2png
+
+from conftest import run
+
+
+def script(path, body):
+    with open(path, "w") as file:
+        file.write("#!/bin/sh\n" + body + "\n")
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_endless_render_is_killed_and_reported_invalid(tmp_path, monkeypatch):
+    monkeypatch.setattr(tex2png, "RENDER_TIMEOUT", 0.2)
+    latex = script(tmp_path / "latex", "echo $$ > ../latex.pid\nexec sleep 30")
+    workdirs = tmp_path / "work"
+    workdirs.mkdir()
+
+    status, png = run(tex2png.tex2png(
+        r"\def\x{\x}\x", latex=latex, dvipng=latex, tempdir=str(workdirs),
+        formatdir=None))
+
+    assert (status, png) == (-1, None)
+    # the working directory is gone, and so is the process that used it
+    assert os.listdir(str(workdirs)) == ["latex.pid"]
+    pid = int((workdirs / "latex.pid").read_text())
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        pass
+    else:
+        raise AssertionError("latex is still running")
+
+
+def fake_tex(tmp_path, latex_body):
+    """
+    :return: a latex that logs its arguments and runs latex_body, and a
+    dvipng that always works.
+    """
+    latex = script(tmp_path / "latex",
+                   'echo "$@" >> ../latex.log\n' + latex_body)
+    dvipng = script(tmp_path / "dvipng", "echo png > snippet.png")
+    return latex, dvipng
+
+
+def render_twice(tmp_path, monkeypatch, latex_body):
+    latex, dvipng = fake_tex(tmp_path, latex_body)
+    workdirs = tmp_path / "work"
+    workdirs.mkdir()
+    formatdir = str(tmp_path / "formats")
+    # as if get_format had already built it
+    key = (latex, formatdir, 20, 30)
+    monkeypatch.setattr(tex2png, "formats", {key: "tex2png-20-30"})
+
+    statuses = [run(tex2png.tex2png("x", latex=latex, dvipng=dvipng,
+                                    tempdir=str(workdirs),
+                                    formatdir=formatdir))[0]
+                for _ in range(2)]
+    log = (workdirs / "latex.log").read_text().splitlines()
+    return statuses, log, tex2png.formats[key]
+
+
+def test_broken_format_falls_back_and_is_dropped(tmp_path, monkeypatch):
+    # compiles without the format only
+    statuses, log, fmt = render_twice(
+        tmp_path, monkeypatch,
+        'case "$1" in -fmt=*) exit 1;; esac\ntouch snippet.dvi')
+
+    assert statuses == [0, 0]
+    assert fmt is None
+    # the second render goes straight to the full preamble
+    assert [line.startswith("-fmt=") for line in log] == [True, False, False]
+
+
+def test_invalid_snippet_keeps_the_format(tmp_path, monkeypatch):
+    statuses, log, fmt = render_twice(tmp_path, monkeypatch, "exit 1")
+
+    assert statuses == [-1, -1]
+    assert fmt == "tex2png-20-30"
@@ -0,0 +1,134 @@
+"""
+Tests for the trigger automaton and index in src/triggers.py.
+"""
+
+import random
+
+from src.triggers import TriggerAutomaton, TriggerIndex
+
+
+def naive_search(patterns: dict, text: str):
+    return {parrot_id for trigger, parrot_id in patterns.items()
+            if trigger in text}
+
+
+def test_search_finds_overlapping_and_nested_triggers():
+    automaton = TriggerAutomaton([("he", 1), ("she", 2), ("his", 3),
+                                  ("hers", 4)])
+
+    assert automaton.search("ushers") == {1, 2, 4}
+    assert automaton.search("this") == {3}
+    assert automaton.search("nothing here") == {1}
+    assert automaton.search("xyz") == set()
+
+
+def test_add_after_search_rebuilds_the_failure_links():
+    automaton = TriggerAutomaton([("abc", 1)])
+    assert automaton.search("xabcd") == {1}
+
+    # bcd is only found through a failure link out of the abc branch
+    automaton.add("bcd", 2)
+    assert automaton.stale
+    assert automaton.search("xabcd") == {1, 2}
+    assert not automaton.stale
+
+
+def test_removed_triggers_stop_matching():
+    automaton = TriggerAutomaton([("cat", 1), ("cats", 2), ("dog", 1)])
+    assert automaton.search("cats and dogs") == {1, 2}
+
+    automaton.remove("cats")
+    assert automaton.search("cats") == {1}
+
+    automaton.remove_parrot(1)
+    assert automaton.search("cats and dogs") == set()
+    assert len(automaton) == 0
+
+    # removing what is not there changes nothing
+    automaton.remove("bird")
+    assert not automaton.dirty
+
+
+def test_trigger_moved_to_another_parrot_leaves_the_old_one():
+    automaton = TriggerAutomaton([("hello", 1)])
+    assert automaton.search("hello there") == {1}
+
+    automaton.add("hello", 2)
+    assert automaton.search("hello there") == {2}
+
+
+def test_automaton_agrees_with_substring_search():
+    rng = random.Random(0)
+    alphabet = "abc "
+
+    def word(low, high):
+        return "".join(rng.choice(alphabet)
+                       for _ in range(rng.randint(low, high)))
+
+    automaton = TriggerAutomaton()
+    patterns = {}
+    for _ in range(300):
+        action = rng.random()
+        if action < 0.6:
+            trigger, parrot_id = word(1, 5), rng.randint(1, 8)
+            automaton.add(trigger, parrot_id)
+            patterns[trigger] = parrot_id
+        elif action < 0.8 and patterns:
+            trigger = rng.choice(sorted(patterns))
+            automaton.remove(trigger)
+            del patterns[trigger]
+        else:
+            parrot_id = rng.randint(1, 8)
+            automaton.remove_parrot(parrot_id)
+            patterns = {trigger: i for trigger, i in patterns.items()
+                        if i != parrot_id}
+
+        text = word(0, 30)
+        assert automaton.search(text) == naive_search(patterns, text), text
+
+
+def make_index():
+    index = TriggerIndex()
+    for trigger, parrot_id, alias in [("hello", 1, False), ("help", 2, False),
+                                      ("helpme", 2, True), ("world", 3, False),
+                                      ("hey", 1, True)]:
+        index.add(trigger, parrot_id, alias)
+    return index
+
+
+def test_completions_are_sorted_and_limited_to_the_prefix():
+    index = make_index()
+
+    assert index.completions("hel") == ["hello", "help", "helpme"]
+    assert index.completions("help") == ["help", "helpme"]
+    assert index.completions("x") == []
+    assert index.completions() == ["hello", "help", "helpme", "hey",
+                                   "world"]
+
+
+def test_parrots_tell_ambiguous_prefixes_apart():
+    index = make_index()
+
+    # two triggers, but the same parrot: not ambiguous
+    assert index.parrots("help") == {2}
+    assert index.parrots("he") == {1, 2}
+    assert index.parrots("w") == {3}
+    assert index.parrots("z") == set()
+
+
+def test_index_remove_and_remove_parrot():
+    index = make_index()
+
+    index.remove("help")
+    assert "help" not in index
+    assert index.get("helpme") == (2, True)
+    assert index.completions("help") == ["helpme"]
+
+    index.remove_parrot(1)
+    assert index.completions() == ["helpme", "world"]
+    assert len(index) == 2
+
+    # moving a trigger to another parrot keeps one entry for it
+    index.add("world", 4, False)
+    assert index.get("world") == (4, False)
+    assert len(index) == 2